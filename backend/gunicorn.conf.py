@@ -0,0 +1,34 @@
+"""Production server profile: `gunicorn -c gunicorn.conf.py main:app`"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# One async worker per core is enough for an I/O-bound app; WEB_CONCURRENCY overrides
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "utils.workers.SanctuaryUvicornWorker"
+
+# Import the app once in the master so workers fork with modules already loaded.
+# Provider clients are created lazily inside each worker, never before the fork.
+preload_app = True
+
+# Graceful restarts: `kill -HUP <master>` replaces workers without dropping requests.
+# With preload_app the code is loaded once in the master, so HUP does not pick up
+# new application code; deploys need a full restart.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth, staggered to avoid a herd
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+# Load balancers allowed to set X-Forwarded-For / X-Forwarded-Proto. Uvicorn
+# rewrites the client address from these headers only for trusted peers, which
+# is what per-IP rate limits key on. Comma-separated IPs/CIDRs, or "*".
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Workers hand uvicorn.access/uvicorn.error to these handlers, then the app's
+# startup reroutes both through its non-blocking JSON log queue.
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,125 @@
+"""Auth capacity scenario: many sessions refreshing at once.
+
+Signs up (or signs in) a pool of test users, then for each concurrency level
+runs workers that refresh a session and fetch /me with the new access token,
+optionally mixing in password sign-ins. Every request asks for a profile
+(X-Profile set to the target's PROFILE_SECRET), so the report splits server
+time into hash, jwt, db and serialize alongside throughput and latency percentiles.
+
+    PROFILE_SECRET=... python -m loadtest.auth_load --base-url http://localhost:8000 --users 200 --levels 1,10,50,100,200
+
+Raise the RATE_LIMIT_* settings on the target first, or the limiter will cap
+the curve instead of the auth path.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+import httpx
+
+PROFILED = {"X-Profile": ""}
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for part in filter(None, (p.strip() for p in header.split(","))):
+        name, _, duration = part.partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+async def create_sessions(client: httpx.AsyncClient, users: int, password: str) -> List[Dict[str, str]]:
+    """Sign up test users, falling back to sign-in for ones that already exist"""
+    semaphore = asyncio.Semaphore(20)
+
+    async def session(i: int):
+        email = f"loadtest+{i}@example.com"
+        async with semaphore:
+            response = await client.post("/signup", json={"name": f"Load Test {i}", "email": email, "password": password})
+            if response.status_code == 400:
+                response = await client.post("/signin", json={"email": email, "password": password})
+            response.raise_for_status()
+            body = response.json()
+            return {"email": email, "refresh_token": body["refresh_token"]}
+
+    return await asyncio.gather(*(session(i) for i in range(users)))
+
+async def run_level(client: httpx.AsyncClient, sessions: List[Dict[str, str]], concurrency: int, duration: float, password: str, signin_ratio: float):
+    latencies = defaultdict(list)
+    server = defaultdict(lambda: defaultdict(float))
+    counts = defaultdict(int)
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def timed(name: str, request):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await request
+        latencies[name].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+        for category, ms in parse_server_timing(response.headers.get("Server-Timing", "")).items():
+            server[name][category] += ms
+        counts[name] += 1
+        return response
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            session = random.choice(sessions)
+            if random.random() < signin_ratio:
+                await timed("signin", client.post("/signin", json={"email": session["email"], "password": password}, headers=PROFILED))
+                continue
+            response = await timed("refresh", client.post("/refresh", json={"refresh_token": session["refresh_token"]}, headers=PROFILED))
+            if response.status_code != 200:
+                continue
+            tokens = response.json()
+            session["refresh_token"] = tokens["refresh_token"]
+            await timed("me", client.get("/me", headers={**PROFILED, "Authorization": f"Bearer {tokens['access_token']}"}))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    print(f"\nconcurrency={concurrency}  requests={total}  rps={total / elapsed:.1f}  errors={errors}")
+    print(f"  {'endpoint':<8} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8}   server ms/request by category")
+    for name in sorted(latencies):
+        values = latencies[name]
+        breakdown = "  ".join(f"{category}={ms / counts[name]:.2f}" for category, ms in sorted(server[name].items()))
+        print(f"  {name:<8} {len(values):>6} {statistics.median(values):>8.1f} {percentile(values, 0.95):>8.1f} {percentile(values, 0.99):>8.1f}   {breakdown}")
+    return concurrency, total / elapsed
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--levels", default="1,10,25,50,100")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per concurrency level")
+    parser.add_argument("--signin-ratio", type=float, default=0.0, help="fraction of iterations doing a bcrypt sign-in")
+    parser.add_argument("--password", default="load-test-password")
+    parser.add_argument("--profile-secret", default=os.environ.get("PROFILE_SECRET", ""), help="the target's PROFILE_SECRET")
+    args = parser.parse_args()
+    PROFILED["X-Profile"] = args.profile_secret
+
+    levels = [int(level) for level in args.levels.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        sessions = await create_sessions(client, args.users, args.password)
+        curve = [await run_level(client, sessions, level, args.duration, args.password, args.signin_ratio) for level in levels]
+
+    print("\ncapacity curve (concurrency -> requests/s)")
+    peak = max(rps for _, rps in curve)
+    for concurrency, rps in curve:
+        print(f"  {concurrency:>5} {rps:>9.1f} {'#' * int(40 * rps / peak) if peak else ''}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
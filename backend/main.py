@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException, status, Depends 
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Query, status, Depends 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from utils.config import settings
-from utils.helpers import enhanced_emotion_analysis, intelligent_media_parsing, enhanced_qloo_recommendations, create_personalized_ritual
-from utils.logger import logger
-from utils.database import _select, _insert, _update
+from utils.helpers import enhanced_emotion_analysis, pipelined_recommendations, create_personalized_ritual, refine_ritual
+from utils.ritual_templates import compose_ritual
+from utils.logger import logger, request_id_var, get_log_stats, route_server_loggers
+from utils.database import resources, _select, _insert_returning, _update, _rpc
 from utils.models import *
 from utils.security import *
+from utils.rate_limit import rate_limit
+from utils.ritual_store import store_ritual, expand_ritual, get_recommendation_sets, export_rituals
+from utils.ranking import record_ritual_rating
+from utils.cache import get_cache_stats
+from utils.profiling import ProfiledORJSONResponse, ProfilingMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any
-import json
+from contextlib import asynccontextmanager
+from uuid import uuid4
+import zlib
 
-app = FastAPI(name="Sanctuary API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Route server logs through the app queue; provider clients are created lazily and closed on shutdown"""
+    route_server_loggers()
+    yield
+    await resources.aclose()
+
+app = FastAPI(name="Sanctuary API", lifespan=lifespan, default_response_class=ProfiledORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -19,23 +37,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RequestContextMiddleware:
+    """Tag every log record emitted while handling a request with its request ID"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = Headers(scope=scope).get("X-Request-ID") or uuid4().hex
+
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+# Added last so it runs outermost: profile log records carry the request ID
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestContextMiddleware)
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
     return {"success": True}
 
 
-@app.post("/signup", response_model=TokenResponse)
+@app.get("/metrics")
+def metrics(admin: UserResponse = Depends(get_admin_user)):
+    """Internal counters for operational dashboards"""
+    return {"logging": get_log_stats(), "cache": get_cache_stats()}
+
+
+@app.post("/signup", response_model=TokenResponse, dependencies=[rate_limit("cheap", authenticated=False)])
 async def signup(user_data: UserSignupRequest):
     """Register a new user with email and password"""
     
-    existing_user = await _select("users", filters=[("email", user_data.email)])
-    if existing_user.data:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User with this email already exists"
-        )
-    
     password_hash = get_password_hash(user_data.password)
     user_record = {
         "name": user_data.name,
@@ -46,12 +90,12 @@ async def signup(user_data: UserSignupRequest):
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    result = await _insert("users", user_record)
+    result = await _insert_returning("users", user_record, on_conflict="email")
     
     if not result.data:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to create user"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this email already exists"
         )
     
     user = result.data[0]
@@ -65,7 +109,7 @@ async def signup(user_data: UserSignupRequest):
         user=UserResponse(**user)
     )
 
-@app.post("/signin", response_model=TokenResponse)
+@app.post("/signin", response_model=TokenResponse, dependencies=[rate_limit("cheap", authenticated=False)])
 async def signin(login_data: UserLoginRequest):
     """Sign in with email and password"""
     
@@ -93,12 +137,12 @@ async def signin(login_data: UserLoginRequest):
         user=UserResponse(**user)
     )
 
-@app.get("/me", response_model=UserResponse)
+@app.get("/me", response_model=UserResponse, dependencies=[rate_limit("cheap")])
 async def get_current_user_profile(current_user: UserResponse = Depends(get_current_user)):
     """Get current user profile"""
     return current_user
 
-@app.post("/refresh", response_model=TokenResponse)
+@app.post("/refresh", response_model=TokenResponse, dependencies=[rate_limit("cheap", authenticated=False)])
 async def refresh_token(request: RefreshTokenRequest):
     """Refresh access token using refresh token"""
     
@@ -122,7 +166,7 @@ async def refresh_token(request: RefreshTokenRequest):
         user=UserResponse(**user)
     )
 
-@app.post("/change-password", response_model=MessageResponse)
+@app.post("/change-password", response_model=MessageResponse, dependencies=[rate_limit("cheap")])
 async def change_password(
     request: PasswordChangeRequest,
     current_user: UserResponse = Depends(get_current_user)
@@ -150,7 +194,7 @@ async def change_password(
     
     return MessageResponse(message="Password changed successfully")
 
-@app.post("/analyze-emotion", response_model=Dict[str, Any])
+@app.post("/analyze-emotion", response_model=Dict[str, Any], dependencies=[rate_limit("expensive")])
 async def analyze_emotion(request: EmotionRequest, user: str = Depends(get_current_user)):
     """Enhanced emotion analysis with detailed insights"""
     if not settings.OPENAI_API_KEY:
@@ -171,8 +215,8 @@ async def analyze_emotion(request: EmotionRequest, user: str = Depends(get_curre
         logger.error(f"Emotion analysis endpoint error: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-@app.post("/get-ritual", response_model=RitualResponse)
-async def create_ritual(request: RitualRequest, user: str = Depends(get_current_user)):
+@app.post("/get-ritual", response_model=RitualResponse, dependencies=[rate_limit("expensive")])
+async def create_ritual(request: RitualRequest, background_tasks: BackgroundTasks, user: str = Depends(get_current_user)):
     """Main ritual creation endpoint with full pipeline"""
     if not settings.OPENAI_API_KEY or not settings.QLOO_API_KEY:
         raise HTTPException(status_code=500, detail="Required API keys not configured")
@@ -189,24 +233,27 @@ async def create_ritual(request: RitualRequest, user: str = Depends(get_current_
         #     "stress_level": 5
         # }
         
-        # Step 2: Parse media intelligently
-        structured_media = await intelligent_media_parsing(request.comfort_media)
+        # Step 2 & 3: Parse media and fetch recommendations per entity as it streams in
+        structured_media, recommendations = await pipelined_recommendations(request.comfort_media, emotional_analysis)
         # print("structured_media", structured_media)
         if not structured_media:
             raise HTTPException(
                 status_code=400,
                 detail="Could not identify any media from your input. Please be more specific."
             )
-        
-        # Step 3: Get enhanced recommendations
-        recommendations = await enhanced_qloo_recommendations(structured_media, emotional_analysis)
         # print("recommendations", recommendations)
-        # Step 4: Create personalized ritual
-        ritual_content = await create_personalized_ritual(
-            emotional_analysis,
-            recommendations,
-            request.preferences
+        # Step 4: Create personalized ritual; urgent requests get an instant template by default
+        composer = request.composer or (
+            RitualComposer.INSTANT if emotional_analysis.get("urgency") == "high" else RitualComposer.LLM
         )
+        if composer == RitualComposer.LLM:
+            ritual_content = await create_personalized_ritual(
+                emotional_analysis,
+                recommendations,
+                request.preferences
+            )
+        else:
+            ritual_content = compose_ritual(emotional_analysis, recommendations)
         # print("ritual_content", ritual_content)
         
         # Step 5: Save to database
@@ -217,15 +264,22 @@ async def create_ritual(request: RitualRequest, user: str = Depends(get_current_
             comfort_media=request.comfort_media,
             ritual_content=ritual_content,
             recommendations=recommendations,
+            wellness_category=emotional_analysis.get("wellness_category", "general"),
             estimated_duration=emotional_analysis.get("recommended_duration", "30min"),
             created_at=datetime.now(timezone.utc).isoformat()
         )
-        with open("ritual.json", "w") as f:
-            json.dump(ritual_record.dict(), f)
-        ritual = await _insert("rituals", ritual_record.model_dump())
+        ritual = await store_ritual(ritual_record.model_dump())
+        ritual_id = ritual.get("id") if ritual else None
+        
+        # Step 6: Refine instant rituals with the LLM after responding
+        refining = composer == RitualComposer.INSTANT and ritual_id is not None
+        if refining:
+            background_tasks.add_task(refine_ritual, ritual_id, emotional_analysis, recommendations, request.preferences)
         
         return RitualResponse(
             ritual=ritual_record,
+            ritual_id=ritual_id,
+            refining=refining,
             success=True
         )
         
@@ -235,14 +289,70 @@ async def create_ritual(request: RitualRequest, user: str = Depends(get_current_
         logger.error(f"Ritual creation error: {e}")
         raise HTTPException(status_code=500, detail="Failed to create ritual")
 
-@app.post("/feedback")
-async def submit_feedback(request: FeedbackRequest, user: str = Depends(get_current_user)):
+@app.get("/rituals", response_model=RitualHistoryResponse, dependencies=[rate_limit("cheap")])
+async def list_rituals(limit: int = Query(20, ge=1, le=100), user: str = Depends(get_current_user)):
+    """Ritual history without content; recommendation sets are sent once per distinct set"""
+    columns = "id,emotional_need,comfort_media,recommendations_hash,wellness_category,estimated_duration,rating,created_at"
+    result = await _select("rituals", columns=columns, filters=[("user_id", str(user.id))], order="created_at", desc=True, limit=limit)
+    rituals = [RitualSummary(**row) for row in result.data]
+    
+    return RitualHistoryResponse(
+        rituals=rituals,
+        recommendation_sets=await get_recommendation_sets(r.recommendations_hash for r in rituals)
+    )
+
+@app.get("/rituals/export", dependencies=[rate_limit("cheap")])
+async def export_ritual_history(gzip: bool = False, user: str = Depends(get_current_user)):
+    """Stream the user's full ritual history as NDJSON, optionally gzip-compressed"""
+    lines = export_rituals(str(user.id))
+    if not gzip:
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+    
+    async def compressed():
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        async for chunk in lines:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    return StreamingResponse(
+        compressed(),
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="rituals.ndjson.gz"'}
+    )
+
+@app.get("/rituals/{ritual_id}", response_model=RitualDetail, dependencies=[rate_limit("cheap")])
+async def get_ritual(ritual_id: str, user: str = Depends(get_current_user)):
+    """Get a single ritual with its decompressed content"""
+    result = await _select("rituals", filters=[("id", ritual_id), ("user_id", str(user.id))])
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Ritual not found")
+    
+    ritual = StoredRitual(**result.data[0])
+    recommendation_sets = await get_recommendation_sets([ritual.recommendations_hash])
+    
+    return RitualDetail(**await expand_ritual(ritual, recommendation_sets), user_id=str(user.id))
+
+@app.post("/feedback", dependencies=[rate_limit("cheap")])
+async def submit_feedback(request: FeedbackRequest, background_tasks: BackgroundTasks, user: str = Depends(get_current_user)):
     """Submit feedback for a ritual"""
-    ritual = await _select("rituals", {"id": request.ritual_id})
-    if not ritual:
+    result = await _rpc("submit_ritual_feedback", {
+        "p_ritual_id": request.ritual_id,
+        "p_user_id": str(user.id),
+        "p_rating": request.rating
+    })
+    if not result.data:
         raise HTTPException(status_code=404, detail="Ritual not found")
     
-    await _update(table="rituals", filters=[("id", request.ritual_id)], data={"rating": request.rating})
+    feedback = result.data[0]
+    background_tasks.add_task(
+        record_ritual_rating,
+        feedback["wellness_category"],
+        feedback["recommendations_hash"],
+        request.rating,
+        feedback["previous_rating"]
+    )
     
     return {
         "success": True,
@@ -251,5 +361,6 @@ async def submit_feedback(request: FeedbackRequest, user: str = Depends(get_curr
     }
 
 if __name__ == "__main__":
+    # Development server; use `gunicorn -c gunicorn.conf.py main:app` in production
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=settings.PORT, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=settings.PORT, reload=True, proxy_headers=True, forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS)
\ No newline at end of file
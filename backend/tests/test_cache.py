@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from utils import cache
+from utils.database import resources
+from utils.serialization import pack
+
+
+class FakeRedis:
+    """Just enough of redis.asyncio for the cache: GET, SET (nx/px/ex) and the unlock script"""
+
+    def __init__(self):
+        self.data = {}
+        self.error = None
+
+    async def get(self, key):
+        if self.error:
+            raise self.error
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, px=None, ex=None):
+        if self.error:
+            raise self.error
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+            return 1
+        return 0
+
+
+def use_fake_redis():
+    redis = FakeRedis()
+    resources.override(redis=redis)
+    return redis
+
+
+def entry(value, expires_in, delta=0.0):
+    return pack({"v": value, "exp": time.time() + expires_in, "delta": delta})
+
+
+class CountingLoader:
+    def __init__(self, value="fresh", delay=0.0):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.value
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_fresh_entry_is_a_hit():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.data["k"] = entry("cached", 3600)
+        loader = CountingLoader()
+        assert await cache.cache_fetch("k", loader, 60, 600) == "cached"
+        assert loader.calls == 0
+    asyncio.run(scenario())
+
+
+def test_stale_entry_is_served_while_refreshing_in_background():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.data["k"] = entry("stale", -1)
+        loader = CountingLoader()
+        assert await cache.cache_fetch("k", loader, 60, 600) == "stale"
+        await settle()
+        assert loader.calls == 1
+        assert await cache.cache_fetch("k", loader, 60, 600) == "fresh"
+        assert "lock:k" not in redis.data
+    asyncio.run(scenario())
+
+
+def test_one_background_refresh_per_key():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.data["k"] = entry("stale", -1)
+        loader = CountingLoader(delay=0.01)
+        for _ in range(5):
+            assert await cache.cache_fetch("k", loader, 60, 600) == "stale"
+        await asyncio.sleep(0.05)
+        assert loader.calls == 1
+    asyncio.run(scenario())
+
+
+def test_refresh_skipped_when_another_worker_holds_the_lock():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.data["k"] = entry("stale", -1)
+        redis.data["lock:k"] = "other-worker"
+        contended = cache.get_cache_stats()["refresh_lock_contended"]
+        loader = CountingLoader()
+        assert await cache.cache_fetch("k", loader, 60, 600) == "stale"
+        await settle()
+        assert loader.calls == 0
+        assert cache.get_cache_stats()["refresh_lock_contended"] == contended + 1
+    asyncio.run(scenario())
+
+
+def test_cold_misses_share_one_load():
+    async def scenario():
+        use_fake_redis()
+        loader = CountingLoader(delay=0.01)
+        results = await asyncio.gather(*(cache.cache_fetch("k", loader, 60, 600) for _ in range(5)))
+        assert results == ["fresh"] * 5
+        assert loader.calls == 1
+    asyncio.run(scenario())
+
+
+def test_malformed_entries_are_misses():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.data["legacy"] = pack({"music": []})
+        redis.data["garbage"] = b"\xc1"
+        for key in ("legacy", "garbage"):
+            assert await cache.swr_get(key) is None
+            loader = CountingLoader()
+            assert await cache.cache_fetch(key, loader, 60, 600) == "fresh"
+            assert loader.calls == 1
+    asyncio.run(scenario())
+
+
+def test_redis_errors_load_immediately():
+    async def scenario():
+        redis = use_fake_redis()
+        redis.error = ConnectionError("down")
+        loader = CountingLoader()
+        started = time.perf_counter()
+        assert await cache.cache_fetch("k", loader, 60, 600) == "fresh"
+        assert time.perf_counter() - started < cache.MISS_WAIT_SECONDS
+        assert loader.calls == 1
+    asyncio.run(scenario())
+
+
+def test_waiters_load_themselves_when_the_owner_is_cancelled():
+    async def scenario():
+        use_fake_redis()
+        loader = CountingLoader(delay=0.05)
+        owner = asyncio.create_task(cache.cache_fetch("k", loader, 60, 600))
+        await settle()
+        waiter = asyncio.create_task(cache.cache_fetch("k", loader, 60, 600))
+        await settle()
+        owner.cancel()
+        assert await waiter == "fresh"
+        assert loader.calls == 2
+    asyncio.run(scenario())
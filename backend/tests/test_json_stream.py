@@ -0,0 +1,61 @@
+from utils.json_stream import JSONObjectStream
+
+
+def feed_all(chunks):
+    parser = JSONObjectStream()
+    objects = []
+    for chunk in chunks:
+        objects.extend(parser.feed(chunk))
+    parser.close()
+    return objects
+
+
+def test_emits_each_object_in_array():
+    text = '[{"type": "film/movie", "name": "Spirited Away"}, {"type": "music/artist", "name": "Radiohead"}]'
+    assert feed_all([text]) == [
+        {"type": "film/movie", "name": "Spirited Away"},
+        {"type": "music/artist", "name": "Radiohead"},
+    ]
+
+
+def test_skips_markdown_fences():
+    text = '```json\n[{"type": "book/book", "name": "Big Magic"}]\n```'
+    assert feed_all([text]) == [{"type": "book/book", "name": "Big Magic"}]
+
+
+def test_tolerates_surrounding_prose():
+    text = 'Sure! Here is the result: {"type": "podcast", "name": "Calm"} Hope that helps.'
+    assert feed_all([text]) == [{"type": "podcast", "name": "Calm"}]
+
+
+def test_braces_and_escaped_quotes_inside_strings():
+    text = r'[{"type": "film/movie", "name": "A \"{weird}\" title \\"}]'
+    assert feed_all([text]) == [{"type": "film/movie", "name": 'A "{weird}" title \\'}]
+
+
+def test_nested_objects_stay_with_parent():
+    text = '{"entities": [{"type": "tv/show", "name": "Bluey"}], "meta": {"n": 1}}'
+    assert feed_all([text]) == [{"entities": [{"type": "tv/show", "name": "Bluey"}], "meta": {"n": 1}}]
+
+
+def test_objects_split_across_chunks():
+    text = '[{"type": "music/album", "name": "Music for \\"Airports\\""}, {"type": "book/book", "name": "Rest"}]'
+    parser = JSONObjectStream()
+    emitted_at = []
+    for i, char in enumerate(text):
+        for obj in parser.feed(char):
+            emitted_at.append((i, obj))
+    assert [obj for _, obj in emitted_at] == [
+        {"type": "music/album", "name": 'Music for "Airports"'},
+        {"type": "book/book", "name": "Rest"},
+    ]
+    # The first object is emitted as soon as it closes, before the rest arrives
+    assert emitted_at[0][0] == text.index("}")
+
+
+def test_malformed_object_is_skipped():
+    assert feed_all(['{"type": oops} {"type": "podcast", "name": "Calm"}']) == [{"type": "podcast", "name": "Calm"}]
+
+
+def test_unterminated_object_is_discarded_on_close():
+    assert feed_all(['[{"type": "podcast", "name": "Calm"}, {"type": "film']) == [{"type": "podcast", "name": "Calm"}]
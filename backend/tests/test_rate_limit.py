@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from utils import rate_limit
+from utils.database import resources
+from utils.rate_limit import Bucket, RateLimiter
+
+
+class FakeTokenBucketScript:
+    """Stands in for TOKEN_BUCKET_LUA: fixed balances per key, no time-based refill"""
+
+    def __init__(self, tokens=None, retry_ms=1500):
+        self.tokens = tokens or {}
+        self.retry_ms = retry_ms
+        self.calls = 0
+        self.error = None
+
+    async def __call__(self, keys, args):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        leases = args[2::3]
+        for i, key in enumerate(keys):
+            if self.tokens.get(key, 0) < 1:
+                return [i + 1, self.retry_ms] + [0] * len(keys)
+        grants = []
+        for key, lease in zip(keys, leases):
+            granted = min(lease, self.tokens[key])
+            self.tokens[key] -= granted
+            grants.append(granted)
+        return [0, 0] + grants
+
+
+class FakeRedis:
+    def __init__(self, script):
+        self.script = script
+
+    def register_script(self, source):
+        return self.script
+
+
+KEY = "ratelimit:test:ip:1.2.3.4"
+
+
+def make_limiter(script, per_minute=20):
+    resources.override(redis=FakeRedis(script))
+    limiter = RateLimiter()
+    limiter._tiers = {"test": [Bucket("ip", per_minute)]}
+    return limiter
+
+
+async def settle():
+    """Let scheduled background refills run"""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_first_request_is_admitted_on_overdraft_without_waiting_for_redis():
+    async def scenario():
+        script = FakeTokenBucketScript({KEY: 10})
+        limiter = make_limiter(script)
+        await limiter.check("test", ip="1.2.3.4")
+        assert script.calls == 0
+        assert limiter._leased[KEY] == -1
+        await settle()
+        assert script.calls == 1
+        assert limiter._leased[KEY] == 1  # lease of 2 minus the overdrawn token
+    asyncio.run(scenario())
+
+
+def test_background_refill_serves_later_requests_from_memory():
+    async def scenario():
+        script = FakeTokenBucketScript({KEY: 100})
+        limiter = make_limiter(script, per_minute=100)  # lease of 10
+        await limiter.check("test", ip="1.2.3.4")
+        await settle()
+        assert limiter._leased[KEY] == 9
+        for _ in range(4):
+            await limiter.check("test", ip="1.2.3.4")
+        assert script.calls == 1
+        await limiter.check("test", ip="1.2.3.4")  # drops below half a lease
+        await settle()
+        assert script.calls == 2
+        assert limiter._leased[KEY] == 14
+    asyncio.run(scenario())
+
+
+def test_denied_refill_blocks_key_with_retry_after():
+    async def scenario():
+        script = FakeTokenBucketScript({KEY: 0}, retry_ms=1500)
+        limiter = make_limiter(script)
+        await limiter.check("test", ip="1.2.3.4")  # overdraft
+        await settle()
+        with pytest.raises(HTTPException) as excinfo:
+            await limiter.check("test", ip="1.2.3.4")
+        assert excinfo.value.status_code == 429
+        assert excinfo.value.headers["Retry-After"] == "2"
+    asyncio.run(scenario())
+
+
+def test_key_past_overdraft_waits_for_redis_and_is_denied():
+    async def scenario():
+        script = FakeTokenBucketScript({KEY: 0}, retry_ms=500)
+        limiter = make_limiter(script)
+        limiter._leased[KEY] = -1
+        limiter._refilling.add(KEY)  # a refill is in flight, so no background retry
+        with pytest.raises(HTTPException) as excinfo:
+            await limiter.check("test", ip="1.2.3.4")
+        assert script.calls == 1
+        assert excinfo.value.headers["Retry-After"] == "1"
+        assert limiter._leased[KEY] == -1
+    asyncio.run(scenario())
+
+
+def test_redis_errors_fail_open():
+    async def scenario():
+        script = FakeTokenBucketScript()
+        script.error = ConnectionError("down")
+        limiter = make_limiter(script)
+        limiter._leased[KEY] = -1
+        await limiter.check("test", ip="1.2.3.4")
+    asyncio.run(scenario())
+
+
+def test_eviction_keeps_blocks_and_recent_balances(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(rate_limit, "MAX_LOCAL_BUCKETS", 3)
+        script = FakeTokenBucketScript({KEY: 0})
+        limiter = make_limiter(script)
+        await limiter.check("test", ip="1.2.3.4")
+        await settle()
+        for i in range(5):
+            await limiter.check("test", ip=f"10.0.0.{i}")
+        assert len(limiter._leased) == 3
+        assert "ratelimit:test:ip:10.0.0.4" in limiter._leased
+        assert KEY not in limiter._leased
+        with pytest.raises(HTTPException):
+            await limiter.check("test", ip="1.2.3.4")
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+from utils.ritual_templates import ACTIVITIES, compose_ritual
+
+RECOMMENDATIONS = {
+    "music": "'Weightless' by Marconi Union",
+    "music_alt": "'Sleep' by Max Richter",
+    "book": "'Rest' by Alex Soojung-Kim Pang",
+    "podcast": "'Nothing Much Happens'",
+}
+
+
+def activity_count(ritual):
+    # Every activity template ends with its time allotment
+    return sum(paragraph.endswith("mins)") for paragraph in ritual.split("\n\n"))
+
+
+def test_is_deterministic():
+    analysis = {"wellness_category": "burnout", "primary_need": "Rest"}
+    assert compose_ritual(analysis, RECOMMENDATIONS) == compose_ritual(analysis, RECOMMENDATIONS)
+
+
+def test_high_urgency_caps_at_two_activities():
+    ritual = compose_ritual({"urgency": "high"}, RECOMMENDATIONS)
+    assert activity_count(ritual) == 2
+
+
+def test_high_stress_counts_as_high_urgency():
+    ritual = compose_ritual({"urgency": "low", "stress_level": 9}, RECOMMENDATIONS)
+    assert activity_count(ritual) == 2
+
+
+def test_medium_urgency_uses_up_to_three_activities():
+    ritual = compose_ritual({"urgency": "medium"}, RECOMMENDATIONS)
+    assert activity_count(ritual) == 3
+
+
+def test_skips_alt_keys():
+    ritual = compose_ritual({"urgency": "low"}, RECOMMENDATIONS)
+    assert "Marconi Union" in ritual
+    assert "Max Richter" not in ritual
+
+
+def test_skips_unknown_domains():
+    ritual = compose_ritual({}, {"videogame": "'Journey'", "book": "'Rest'"})
+    assert "Journey" not in ritual
+    assert activity_count(ritual) == 1
+
+
+def test_empty_recommendations_fall_back_to_a_general_activity():
+    ritual = compose_ritual({"recommended_duration": "45min"}, {})
+    assert activity_count(ritual) == 0
+    assert "Spend the next 45 minutes" in ritual
+    assert not any(template.split("{rec}")[0] in ritual for template in ACTIVITIES.values())
+
+
+def test_none_primary_need_reads_as_restoration():
+    ritual = compose_ritual({"primary_need": None, "urgency": "medium"}, RECOMMENDATIONS)
+    assert "none" not in ritual.lower()
+    assert "restoration" in ritual
+
+
+def test_unknown_category_uses_general_closing():
+    ritual = compose_ritual({"wellness_category": "unheard_of"}, {})
+    assert ritual.endswith("this moment of sanctuary.")
@@ -0,0 +1,195 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from utils.database import resources
+from utils.logger import logger
+from utils.serialization import pack, unpack
+
+# Stale-while-revalidate cache for provider results.
+#
+# Entries carry a soft expiry; Redis holds them until the hard TTL. Past the
+# soft expiry (or earlier, with probability growing as it approaches, weighted
+# by how long the value took to compute) callers keep getting the cached value
+# while a single background task, guarded by a per-key Redis lock, refreshes it.
+
+REFRESH_LOCK_MS = 30_000
+MISS_WAIT_SECONDS = 0.05
+MISS_WAIT_POLLS = 40
+EARLY_REFRESH_BETA = 1.0
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stale_served": 0,
+    "early_refreshes": 0,
+    "refreshes": 0,
+    "refresh_errors": 0,
+    "refresh_lock_contended": 0,
+    "miss_waits": 0,
+    "malformed_entries": 0,
+    "redis_unavailable": 0,
+}
+_background: Set[asyncio.Task] = set()
+_inflight: Dict[str, asyncio.Future] = {}
+
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def get_cache_stats() -> Dict[str, int]:
+    return dict(_stats)
+
+async def _read(key: str) -> Optional[Dict[str, Any]]:
+    """Fetch an entry; errors and entries not written by `swr_set` read as a miss"""
+    try:
+        raw = await resources.redis.get(key)
+    except Exception as e:
+        logger.warning(f"Cache get error: {e}")
+        return None
+    if raw is None:
+        return None
+    try:
+        entry = unpack(raw)
+    except Exception as e:
+        _stats["malformed_entries"] += 1
+        logger.warning(f"Cache decode error for {key}: {e}")
+        return None
+    if not isinstance(entry, dict) or not {"v", "exp", "delta"} <= entry.keys():
+        _stats["malformed_entries"] += 1
+        logger.warning(f"Ignoring malformed cache entry for {key}")
+        return None
+    return entry
+
+async def swr_get(key: str) -> Optional[Tuple[Any, bool]]:
+    """Return `(value, needs_refresh)` for a cached entry, or None on a miss or error"""
+    entry = await _read(key)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+
+    now = time.time()
+    if now >= entry["exp"]:
+        _stats["stale_served"] += 1
+        return entry["v"], True
+    # XFetch: -log(U) is exponential, so refreshes spread out ahead of expiry
+    if now - entry["delta"] * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= entry["exp"]:
+        _stats["early_refreshes"] += 1
+        return entry["v"], True
+    _stats["hits"] += 1
+    return entry["v"], False
+
+async def swr_set(key: str, value: Any, soft_ttl: int, hard_ttl: int, compute_seconds: float = 0.0) -> None:
+    entry = {"v": value, "exp": time.time() + soft_ttl, "delta": compute_seconds}
+    try:
+        await resources.redis.set(key, pack(entry), ex=hard_ttl)
+    except Exception as e:
+        logger.warning(f"Cache set error: {e}")
+
+async def _acquire_lock(key: str) -> Tuple[Optional[str], bool]:
+    """Return `(token, available)`: a token if the lock was taken, and False if Redis errored"""
+    token = uuid.uuid4().hex
+    try:
+        if await resources.redis.set(f"lock:{key}", token, nx=True, px=REFRESH_LOCK_MS):
+            return token, True
+    except Exception as e:
+        _stats["redis_unavailable"] += 1
+        logger.warning(f"Cache lock error: {e}")
+        return None, False
+    return None, True
+
+async def _release_lock(key: str, token: str) -> None:
+    try:
+        await resources.redis.eval(RELEASE_LOCK_LUA, 1, f"lock:{key}", token)
+    except Exception as e:
+        logger.warning(f"Cache unlock error: {e}")
+
+async def _load_and_store(key: str, loader: Callable[[], Awaitable[Any]], soft_ttl: int, hard_ttl: int) -> Any:
+    started = time.perf_counter()
+    value = await loader()
+    await swr_set(key, value, soft_ttl, hard_ttl, time.perf_counter() - started)
+    return value
+
+async def _refresh(key: str, loader: Callable[[], Awaitable[Any]], soft_ttl: int, hard_ttl: int) -> None:
+    token, available = await _acquire_lock(key)
+    if not available:
+        return  # nowhere to store the refreshed value; the next request retries
+    if token is None:
+        _stats["refresh_lock_contended"] += 1
+        return
+    try:
+        await _load_and_store(key, loader, soft_ttl, hard_ttl)
+        _stats["refreshes"] += 1
+    except Exception as e:
+        _stats["refresh_errors"] += 1
+        logger.warning(f"Background refresh failed for {key}: {e}")
+    finally:
+        await _release_lock(key, token)
+
+def refresh_in_background(key: str, loader: Callable[[], Awaitable[Any]], soft_ttl: int, hard_ttl: int) -> None:
+    """Refresh an entry off the request path; at most one refresh per key runs across workers"""
+    if any(task.get_name() == f"refresh:{key}" for task in _background):
+        return
+    task = asyncio.create_task(_refresh(key, loader, soft_ttl, hard_ttl), name=f"refresh:{key}")
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def cache_fetch(key: str, loader: Callable[[], Awaitable[Any]], soft_ttl: int, hard_ttl: int) -> Any:
+    """Get a value, serving stale entries while refreshing and coalescing cold misses.
+
+    `loader` should raise on failure; failures are never cached.
+    """
+    cached = await swr_get(key)
+    if cached is not None:
+        value, needs_refresh = cached
+        if needs_refresh:
+            refresh_in_background(key, loader, soft_ttl, hard_ttl)
+        return value
+
+    # Cold miss: share one load within this worker, and let one worker load across the fleet
+    if key in _inflight:
+        shared = _inflight[key]
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            if not shared.cancelled():
+                raise  # this request itself was cancelled
+            # The request that owned the load was cancelled; don't fail its waiters with it
+            return await loader()
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        token, available = await _acquire_lock(key)
+        if not available:
+            # Redis is down: no other worker can publish a result, so load right away
+            value = await loader()
+        elif token is None:
+            for _ in range(MISS_WAIT_POLLS):
+                await asyncio.sleep(MISS_WAIT_SECONDS)
+                entry = await _read(key)
+                if entry is not None:
+                    _stats["miss_waits"] += 1
+                    future.set_result(entry["v"])
+                    return entry["v"]
+            value = await loader()
+        else:
+            try:
+                value = await _load_and_store(key, loader, soft_ttl, hard_ttl)
+            finally:
+                await _release_lock(key, token)
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved so an unawaited failure isn't logged
+        raise
+    finally:
+        _inflight.pop(key, None)
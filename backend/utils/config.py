@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from functools import lru_cache
 from typing import Optional
 
 class Settings(BaseSettings):
@@ -22,12 +23,64 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
     
+    # Rate limits (requests per minute)
+    RATE_LIMIT_EXPENSIVE_PER_MINUTE: int = 10
+    RATE_LIMIT_EXPENSIVE_IP_PER_MINUTE: int = 30
+    RATE_LIMIT_EXPENSIVE_GLOBAL_PER_MINUTE: int = 600
+    RATE_LIMIT_CHEAP_PER_MINUTE: int = 120
+    RATE_LIMIT_CHEAP_IP_PER_MINUTE: int = 300
+    
+    # Provider record/replay (live, record or replay)
+    PROVIDER_MODE: str = "live"
+    PROVIDER_CASSETTE: str = "provider_cassette.msgpack"
+    REPLAY_LATENCY_SCALE: float = 1.0
+    
+    # Profiling: fraction of requests profiled and logged server-side, and the
+    # X-Profile header value that returns a Server-Timing breakdown (empty disables it)
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SECRET: str = ""
+    
     # App
     APP_NAME: str = "Sanctuary App"
     PORT: int = 8000
     FRONTEND_URL: str = "http://localhost:3000"
+    FORWARDED_ALLOW_IPS: str = "127.0.0.1"
     
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+class BenchmarkSettings(Settings):
+    """Settings for offline replay benchmarks: credentials and URLs the replayed
+    pipeline never uses default to empty instead of being required"""
+    SUPABASE_URL: str = ""
+    SUPABASE_KEY: str = ""
+    REDIS_URL: str = ""
+    QLOO_API_KEY: str = ""
+    QLOO_API_URL: str = ""
+    OPENAI_API_KEY: str = ""
+    GEMINI_API_KEY: str = ""
+    SECRET_KEY: str = ""
+    REFRESH_SECRET_KEY: str = ""
+    PROVIDER_MODE: str = "replay"
+
+@lru_cache
+def get_settings() -> Settings:
+    """Load settings on first use so importing the app never requires every key"""
+    return Settings()
+
+class _LazySettings:
+    """Module-level proxy that resolves attributes against `get_settings()`.
+
+    Tooling can install other settings with `settings.override(BenchmarkSettings())`.
+    """
+
+    _override: Optional[Settings] = None
+
+    def __getattr__(self, name: str):
+        return getattr(self._override or get_settings(), name)
+
+    def override(self, value: Optional[Settings]) -> None:
+        """Resolve attributes against `value` instead of `get_settings()`; None restores the default"""
+        self._override = value
+
+settings = _LazySettings()
\ No newline at end of file
@@ -1,59 +1,180 @@
-from supabase import create_client, Client
 from utils.config import settings
-from typing import List, Optional, Dict, Any
-from openai import AsyncOpenAI
-import google.generativeai as genai
+from utils.profiling import profile_span
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator
 import asyncio
-import redis
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
-openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-genai.configure(api_key=settings.GEMINI_API_KEY)
+class Resources:
+    """Shared provider clients, created on first use and closed on app shutdown.
+
+    Tests and tooling can swap in fakes with `resources.override(redis=fake)`.
+    """
+
+    def __init__(self):
+        self._supabase = None
+        self._redis = None
+        self._openai = None
+        self._genai = None
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            from supabase import create_client
+            self._supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+        return self._supabase
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            self._redis = redis.Redis.from_url(settings.REDIS_URL)
+        return self._redis
+
+    @property
+    def openai(self):
+        if self._openai is None:
+            from openai import AsyncOpenAI
+            self._openai = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        return self._openai
+
+    @property
+    def genai(self):
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            self._genai = genai
+        return self._genai
+
+    def override(self, **clients):
+        """Replace clients (e.g. with fakes) by name: supabase, redis, openai, genai"""
+        for name, client in clients.items():
+            if not hasattr(self, f"_{name}"):
+                raise AttributeError(f"Unknown resource: {name}")
+            setattr(self, f"_{name}", client)
+
+    async def aclose(self):
+        """Close clients that hold connections and reset the container"""
+        if self._redis is not None:
+            await self._redis.aclose()
+        if self._openai is not None:
+            await self._openai.close()
+        self.__init__()
+
+resources = Resources()
+
+def _apply_filters(query_builder, filters: Optional[List]):
+    """Apply `(column, value)` filters: a list or tuple value matches any of its items (IN), None matches NULL"""
+    for column, value in filters or []:
+        if value is None:
+            query_builder = query_builder.is_(column, "null")
+        elif isinstance(value, (list, tuple)):
+            query_builder = query_builder.in_(column, list(value))
+        else:
+            query_builder = query_builder.eq(column, value)
+    return query_builder
 
 async def _select(table: str, columns: str = "*", filters: Optional[List] = None, order: Optional[str] = None, desc: bool = False, limit: int = None):
+    supabase = resources.supabase
     def query():
         query_builder = supabase.table(table).select(columns)
-        if filters:
-            for column, value in filters:
-                query_builder = query_builder.eq(column, value)
+        query_builder = _apply_filters(query_builder, filters)
         if order:
             query_builder = query_builder.order(order, desc=desc)
         if limit:
             query_builder = query_builder.limit(limit)
         return query_builder.execute()
 
-    res = await asyncio.to_thread(query)
+    with profile_span("db"):
+        res = await asyncio.to_thread(query)
     return res
 
+async def _select_page(table: str, columns: str = "*", filters: Optional[List] = None, after: Optional[Tuple[str, str]] = None, limit: int = 200):
+    """One page in (created_at, id) order, starting after the `after` cursor (keyset pagination)"""
+    supabase = resources.supabase
+    def query():
+        query_builder = supabase.table(table).select(columns)
+        query_builder = _apply_filters(query_builder, filters)
+        if after:
+            created_at, row_id = after
+            query_builder = query_builder.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})')
+        return query_builder.order("created_at").order("id").limit(limit).execute()
+
+    with profile_span("db"):
+        res = await asyncio.to_thread(query)
+    return res
+
+async def _iter_pages(table: str, columns: str = "*", filters: Optional[List] = None, page_size: int = 200) -> AsyncIterator[List[dict]]:
+    """Yield every matching row page by page; only one page is held in memory at a time.
+
+    `columns` must include created_at and id, which form the cursor.
+    """
+    after = None
+    while True:
+        result = await _select_page(table, columns, filters, after, page_size)
+        if not result.data:
+            return
+        yield result.data
+        if len(result.data) < page_size:
+            return
+        last = result.data[-1]
+        after = (last["created_at"], last["id"])
+
 async def _insert(table: str, data: dict):
+    supabase = resources.supabase
     def insert_fn():
         return supabase.table(table).insert(data).execute()
-    res = await asyncio.to_thread(insert_fn)
+    with profile_span("db"):
+        res = await asyncio.to_thread(insert_fn)
     return res
 
 async def _update(table: str, data: dict, filters: Optional[List] = None):
+    """Update matching rows and return them; an empty `.data` means no row matched the filters"""
+    supabase = resources.supabase
     def update_fn():
         query_builder = supabase.table(table).update(data)
-        if filters:
-            for column, value in filters:
-                query_builder = query_builder.eq(column, value)
+        query_builder = _apply_filters(query_builder, filters)
         return query_builder.execute()
-    res = await asyncio.to_thread(update_fn)
+    with profile_span("db"):
+        res = await asyncio.to_thread(update_fn)
+    return res
+
+async def _insert_returning(table: str, data: dict, on_conflict: str):
+    """Insert a row unless it conflicts on `on_conflict`, in one round trip.
+
+    Returns the inserted row in `.data`; `.data` is empty when a conflicting
+    row already existed (INSERT ... ON CONFLICT DO NOTHING RETURNING *).
+    """
+    supabase = resources.supabase
+    def insert_fn():
+        return supabase.table(table).upsert(data, on_conflict=on_conflict, ignore_duplicates=True).execute()
+    with profile_span("db"):
+        res = await asyncio.to_thread(insert_fn)
+    return res
+
+async def _rpc(function: str, params: Optional[Dict[str, Any]] = None):
+    """Call a Postgres function, for multi-step writes that need a single round trip"""
+    supabase = resources.supabase
+    def rpc_fn():
+        return supabase.rpc(function, params or {}).execute()
+    with profile_span("db"):
+        res = await asyncio.to_thread(rpc_fn)
     return res
 
 async def _upsert(table: str, data: List[dict]):
+    supabase = resources.supabase
     def upsert_fn():
         return supabase.table(table).upsert(data).execute()
-    res = await asyncio.to_thread(upsert_fn)
+    with profile_span("db"):
+        res = await asyncio.to_thread(upsert_fn)
     return res
 
 async def _delete(table: str, filters: Optional[List] = None):
+    supabase = resources.supabase
     def delete_fn():
         query_builder = supabase.table(table)
         if filters:
             for column, value in filters:
                 query_builder = query_builder.eq(column, value)
         return query_builder.delete().execute()
-    res = await asyncio.to_thread(delete_fn)
+    with profile_span("db"):
+        res = await asyncio.to_thread(delete_fn)
     return res
@@ -1,59 +1,61 @@
 import json
+import time
+import asyncio
+import hashlib
 import requests
-from utils.logger import logger
+from utils.logger import logger, get_logger
 from utils.config import settings
-from utils.database import redis_client, openai_client, genai
-from typing import Optional, Dict, Any, List
+from utils.database import resources
+from utils.json_stream import JSONObjectStream
+from utils.ritual_store import update_ritual_content
+from utils.replay import CassetteMiss, provider_call, provider_stream
+from utils.ranking import ranking_store, rank_candidates
+from utils.cache import cache_fetch, swr_get, swr_set, refresh_in_background
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+# Full provider responses; sampled and size-capped by the logging pipeline
+payload_logger = get_logger("sanctuary.payloads")
 
 def clean_gemini_response(raw_text: str) -> dict:
     try:
         raw_text = raw_text.replace("```json\n", "").replace("\n```", "")
         
         return json.loads(raw_text)
-    except Exception as e:
-        logger.error(f"Error parsing JSON response: {e}")
+    except json.JSONDecodeError:
+        # Tolerate prose around the payload by falling back to the first complete object
+        objects = JSONObjectStream().feed(raw_text)
+        if objects:
+            return objects[0]
+        logger.error(f"Error parsing JSON response: {raw_text[:200]}")
         raise
 
 async def get_cache_key(prefix: str, *args) -> str:
     """Generate a cache key from prefix and arguments"""
     return f"{prefix}:" + ":".join(str(arg) for arg in args)
 
-async def cache_get(key: str) -> Optional[str]:
-    """Get value from cache"""
-    if not redis_client:
-        return None
-    try:
-        return redis_client.get(key)
-    except Exception as e:
-        logger.warning(f"Cache get error: {e}")
-        return None
+async def gemini_generate(system_prompt: str, user_prompt: str) -> str:
+    """Single Gemini completion, routed through provider record/replay"""
+    async def generate():
+        model = resources.genai.GenerativeModel(settings.GEMINI_MODEL, system_instruction=system_prompt)
+        response = await model.generate_content_async(user_prompt)
+        return response.text
 
-async def cache_set(key: str, value: str, ttl: int = 3600):
-    """Set value in cache with TTL"""
-    if not redis_client:
-        return
-    try:
-        redis_client.setex(key, ttl, value)
-    except Exception as e:
-        logger.warning(f"Cache set error: {e}")
+    request = {"model": settings.GEMINI_MODEL, "system": system_prompt, "prompt": user_prompt}
+    return await provider_call("gemini", request, generate)
+
+def gemini_stream(system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+    """Streamed Gemini completion text chunks, routed through provider record/replay"""
+    async def stream():
+        model = resources.genai.GenerativeModel(settings.GEMINI_MODEL, system_instruction=system_prompt)
+        response = await model.generate_content_async(user_prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+    request = {"model": settings.GEMINI_MODEL, "system": system_prompt, "prompt": user_prompt, "stream": True}
+    return provider_stream("gemini", request, stream)
 
 async def enhanced_emotion_analysis(text: str, user_id: str) -> Dict[str, Any]:
-    """Enhanced emotion analysis with caching and detailed insights"""
-    # cache_key = await get_cache_key("emotion", user_id, hash(text))
-    # cached_result = await cache_get(cache_key)
-    
-    # if cached_result:
-    #     return json.loads(cached_result)
-
-    return {
-        'primary_need': 'Peace and quiet', 
-        'secondary_emotions': ['Overwhelmed', 'Lonely'], 
-        'stress_level': 7, 
-        'recommended_duration': '30min', 
-        'urgency': 'medium', 
-        'wellness_category': 'burnout'
-    }
-    
+    """Enhanced emotion analysis with detailed insights"""
     system_prompt = """
     You are an expert emotional wellness AI. Analyze the user's text and provide:
     1. Primary emotional need (2-4 words)
@@ -82,7 +84,7 @@ async def enhanced_emotion_analysis(text: str, user_id: str) -> Dict[str, Any]:
     
     try:
         
-        # response = await openai_client.chat.completions.create(
+        # response = await resources.openai.chat.completions.create(
         #     model=settings.OPENAI_MODEL,
         #     messages=[
         #         {"role": "system", "content": system_prompt},
@@ -93,17 +95,9 @@ async def enhanced_emotion_analysis(text: str, user_id: str) -> Dict[str, Any]:
         # )
         
         # result = json.loads(response.choices[0].message.content)
-        # # await cache_set(cache_key, json.dumps(result), ttl=1800)  # 30 min cache
         # logger.info(result)
-        model = genai.GenerativeModel(
-            settings.GEMINI_MODEL,
-            system_instruction=system_prompt
-        )
-
-        response = model.generate_content(user_prompt)
-        with open("response_emotion_analysis.json", "w") as f:
-            json.dump(response.text, f)
-        result = clean_gemini_response(response.text)
+        response_text = await gemini_generate(system_prompt, user_prompt)
+        result = clean_gemini_response(response_text)
         # result = response.text
         # logger.info(result)
         return result
@@ -120,18 +114,7 @@ async def enhanced_emotion_analysis(text: str, user_id: str) -> Dict[str, Any]:
             "wellness_category": "general"
         }
 
-async def intelligent_media_parsing(media_list: List[str]) -> List[Dict[str, str]]:
-    """Enhanced media parsing with better accuracy and validation"""
-    media_text = ", ".join(media_list)
-    # cache_key = await get_cache_key("media_parse", hash(media_text))
-    # cached_result = await cache_get(cache_key)
-    
-    # if cached_result:
-    #     return json.loads(cached_result)
-
-    return [{'type': 'book/book', 'name': 'The Ocean at the End of the Lane'}, {'type': 'music/album', 'name': 'Music for Airports'}, {'type': 'music/artist', 'name': 'Brian Eno'}]
-    
-    system_prompt = """
+MEDIA_PARSING_PROMPT = """
     You are an expert media cataloger. Parse natural language media references into structured data.
     
     Valid types:
@@ -147,7 +130,24 @@ async def intelligent_media_parsing(media_list: List[str]) -> List[Dict[str, str
     
     Respond with ONLY a JSON array of objects.
     """
-    
+
+MEDIA_PARSE_TTL = 3600
+MEDIA_PARSE_HARD_TTL = 4 * MEDIA_PARSE_TTL
+
+def media_entities(obj: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Entities in a parsed object, unwrapping containers like `{"entities": [...]}`"""
+    if obj.get("type") and obj.get("name"):
+        return [{"type": obj["type"], "name": obj["name"]}]
+    entities = []
+    for value in obj.values():
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    entities.extend(media_entities(item))
+    return entities
+
+async def parse_media_text(media_text: str) -> AsyncIterator[Dict[str, str]]:
+    """Stream entities from the model as each JSON object closes; raises on provider errors"""
     user_prompt = f"""
     Parse this media text: "{media_text}"
     
@@ -162,171 +162,178 @@ async def intelligent_media_parsing(media_list: List[str]) -> List[Dict[str, str
     Now parse the input and return JSON array only:
     """
     
+    parser = JSONObjectStream()
     try:
-        # response = await openai_client.chat.completions.create(
-        #     model=settings.OPENAI_MODEL,
-        #     messages=[
-        #         {"role": "system", "content": system_prompt},
-        #         {"role": "user", "content": user_prompt}
-        #     ],
-        #     response_format={"type": "json_object"},
-        #     temperature=0.2
-        # )
-        
-        # json_data = json.loads(response.choices[0].message.content)
-        # logger.info(json_data)
-
-        model = genai.GenerativeModel(
-            settings.GEMINI_MODEL,
-            system_instruction=system_prompt
-        )
-
-        response = model.generate_content(user_prompt)
-        with open("response_media_parsing.json", "w") as f:
-            json.dump(response.text, f)
-        result = clean_gemini_response(response.text)
-        # logger.info(result)
-        # Extract array from response
-        # if isinstance(json_data, dict):
-        #     logger.info("JSON data is a dictionary")
-        #     for key in json_data:
-        #         if isinstance(json_data[key], list):
-        #             logger.info("JSON data is a list", json_data[key])
-        #             result = json_data[key]
-        #             break
-        #     else:
-        #         result = []
-        # else:
-        #     result = json_data if isinstance(json_data, list) else []
-        
-        # await cache_set(cache_key, json.dumps(result), ttl=3600)  # 1 hour cache
-        return result
-        
+        async for text in gemini_stream(MEDIA_PARSING_PROMPT, user_prompt):
+            for obj in parser.feed(text):
+                for entity in media_entities(obj):
+                    yield entity
+    finally:
+        parser.close()
+
+async def collect_media_entities(media_text: str) -> List[Dict[str, str]]:
+    entities = [entity async for entity in parse_media_text(media_text)]
+    if not entities:
+        raise ValueError("Media parsing returned no entities")
+    return entities
+
+async def stream_media_parsing(media_list: List[str]) -> AsyncIterator[Dict[str, str]]:
+    """Parse media references, yielding each entity as soon as the model emits it.
+
+    Results are cached with stale-while-revalidate; a stale entry is served
+    immediately while one background task re-parses it.
+    """
+    media_text = ", ".join(media_list)
+    cache_key = await get_cache_key("media_parse:v2", hashlib.sha256(media_text.encode()).hexdigest())
+    cached = await swr_get(cache_key)
+    if cached is not None:
+        entities, needs_refresh = cached
+        if needs_refresh:
+            refresh_in_background(cache_key, lambda: collect_media_entities(media_text), MEDIA_PARSE_TTL, MEDIA_PARSE_HARD_TTL)
+        for entity in entities:
+            yield entity
+        return
+
+    entities = []
+    started = time.perf_counter()
+    try:
+        async for entity in parse_media_text(media_text):
+            entities.append(entity)
+            yield entity
     except Exception as e:
         logger.error(f"Media parsing error: {e}")
-        return []
-
-async def enhanced_qloo_recommendations(structured_seed: List[Dict], emotional_context: Dict) -> Dict[str, str]:
-    """Enhanced Qloo integration with emotional context"""
-    if not structured_seed:
-        return await get_fallback_recommendations(emotional_context)
-
-    with open("structured_seed.json", "w") as f:
-        json.dump(structured_seed, f)
+        return
+    if entities:
+        await swr_set(cache_key, entities, MEDIA_PARSE_TTL, MEDIA_PARSE_HARD_TTL, time.perf_counter() - started)
 
-    with open("emotional_context.json", "w") as f:
-        json.dump(emotional_context, f)
-    
-    # cache_key = await get_cache_key("qloo", hash(str(structured_seed)), emotional_context.get("wellness_category", ""))
-    # cached_result = await cache_get(cache_key)
-    
-    # if cached_result:
-    #     return json.loads(cached_result)
-    
-    headers = {"Content-Type": "application/json", 'X-Api-Key': settings.QLOO_API_KEY}
-    
-    # Enhanced domain selection based on emotional state
+def select_qloo_domains(emotional_context: Dict) -> List[str]:
+    """Pick recommendation domains based on emotional state"""
     base_domains = ["music", "book", "film", "podcast"]
     if emotional_context.get("wellness_category") == "creative_block":
-        domains = ["music", "book", "film"]  # Focus on inspiration
+        return ["music", "book", "film"]  # Focus on inspiration
     elif emotional_context.get("urgency") == "high":
-        domains = ["music", "podcast"]  # Quick access content
-    else:
-        domains = base_domains
+        return ["music", "podcast"]  # Quick access content
+    return base_domains
+
+def format_recommendation(item: Dict) -> str:
+    rec_text = f"'{item.get('name')}'"
+    if item.get('author'):
+        rec_text += f" by {item['author']}"
+    elif item.get('artist'):
+        rec_text += f" by {item['artist']}"
+    return rec_text
+
+def build_recommendations(items_by_domain: Dict[str, List[Dict]], domains: List[str], scores: Optional[Dict[str, float]] = None) -> Dict[str, str]:
+    """Turn Qloo items into the `{domain: text, domain_alt: text}` mapping, best rated first"""
+    recommendations = {}
+    for domain in domains:
+        candidates = list(dict.fromkeys(format_recommendation(item) for item in items_by_domain.get(domain) or []))
+        for i, rec_text in enumerate(rank_candidates(candidates, scores or {})[:2]):  # Get top 2
+            key = f"{domain}" if i == 0 else f"{domain}_alt"
+            recommendations[key] = rec_text
+    return recommendations
+
+# Candidates fetched per domain and seed; re-ranked by user ratings down to two
+QLOO_CANDIDATES_PER_DOMAIN = 4
+QLOO_CACHE_TTL = 1800
+QLOO_CACHE_HARD_TTL = 4 * QLOO_CACHE_TTL
+
+async def qloo_entity_recommendations(entity: Dict[str, str], domains: List[str]) -> Dict[str, List[Dict]]:
+    """Qloo lookup for a single seed entity, cached per entity and domain set"""
+    cache_key = await get_cache_key("qloo_entity:v2", entity.get("type"), entity.get("name"), ",".join(domains))
 
-    with open("domains.json", "w") as f:
-        json.dump(domains, f)
-    
+    headers = {"Content-Type": "application/json", 'X-Api-Key': settings.QLOO_API_KEY}
     payload = {
-        "seed": structured_seed,
+        "seed": [entity],
         "domain": domains,
-        "limit_per_domain": 2,
+        "limit_per_domain": QLOO_CANDIDATES_PER_DOMAIN,
         "include_similar": True
     }
     
-    try:
-        response = requests.post(
-            settings.QLOO_API_URL + '',
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
+    def post():
+        response = requests.post(settings.QLOO_API_URL, headers=headers, json=payload, timeout=10)
         response.raise_for_status()
-        qloo_data = response.json()
-        logger.info(qloo_data)
-        
-        recommendations = {}
-        for domain in domains:
-            if qloo_data.get("data", {}).get(domain):
-                items = qloo_data["data"][domain][:2]  # Get top 2
-                for i, item in enumerate(items):
-                    rec_text = f"'{item.get('name')}'"
-                    if item.get('author'):
-                        rec_text += f" by {item['author']}"
-                    elif item.get('artist'):
-                        rec_text += f" by {item['artist']}"
-                    
-                    key = f"{domain}" if i == 0 else f"{domain}_alt"
-                    recommendations[key] = rec_text
-        
-        # await cache_set(cache_key, json.dumps(recommendations), ttl=1800)
-        return recommendations
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Qloo API error: {e}")
-        return await get_fallback_recommendations(emotional_context)
+        return response.json()
+
+    async def load():
+        qloo_data = await provider_call("qloo", payload, lambda: asyncio.to_thread(post))
+        payload_logger.info(qloo_data)
+        return {domain: qloo_data.get("data", {}).get(domain) or [] for domain in domains}
+
+    try:
+        return await cache_fetch(cache_key, load, QLOO_CACHE_TTL, QLOO_CACHE_HARD_TTL)
+    except (requests.exceptions.RequestException, CassetteMiss) as e:
+        logger.error(f"Qloo API error for {entity.get('name')}: {e}")
+        return {}
+
+async def pipelined_recommendations(media_list: List[str], emotional_context: Dict) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+    """Parse media and fetch Qloo results per entity while the model is still generating.
+
+    Returns the parsed entities and the merged recommendations; falls back to
+    `get_fallback_recommendations` when no entity yields any Qloo items.
+    """
+    domains = select_qloo_domains(emotional_context)
+    structured_media = []
+    lookups = []
+    async for entity in stream_media_parsing(media_list):
+        structured_media.append(entity)
+        lookups.append(asyncio.create_task(qloo_entity_recommendations(entity, domains)))
+
+    if not lookups:
+        return structured_media, {}
+
+    # Interleave per-entity results so each seed contributes its best match first
+    merged: Dict[str, List[Dict]] = {domain: [] for domain in domains}
+    results, scores = await asyncio.gather(
+        asyncio.gather(*lookups),
+        ranking_store.scores(emotional_context.get("wellness_category", "general"))
+    )
+    for rank in range(QLOO_CANDIDATES_PER_DOMAIN):
+        for result in results:
+            for domain in domains:
+                items = result.get(domain) or []
+                if rank < len(items):
+                    merged[domain].append(items[rank])
+
+    recommendations = build_recommendations(merged, domains, scores)
+    if not recommendations:
+        recommendations = await get_fallback_recommendations(emotional_context)
+    return structured_media, recommendations
 
 async def get_fallback_recommendations(emotional_context: Dict) -> Dict[str, str]:
     """Intelligent fallback recommendations based on emotional context"""
     wellness_category = emotional_context.get("wellness_category", "general")
     
+    # Candidates per domain in editorial order; user ratings decide which one is served
     fallback_db = {
         "burnout": {
-            "music": "the album 'Immunity' by Jon Hopkins",
-            "podcast": "the podcast 'Nothing Much Happens'",
-            "book": "the book 'The Power of Now' by Eckhart Tolle"
+            "music": ["the album 'Immunity' by Jon Hopkins", "the album 'Ambient 1: Music for Airports' by Brian Eno"],
+            "podcast": ["the podcast 'Nothing Much Happens'", "the podcast 'Sleep With Me'"],
+            "book": ["the book 'The Power of Now' by Eckhart Tolle", "the book 'Rest' by Alex Soojung-Kim Pang"]
         },
         "creative_block": {
-            "music": "the album 'Music for Airports' by Brian Eno",
-            "film": "the documentary 'Abstract: The Art of Design'",
-            "book": "the book 'Big Magic' by Elizabeth Gilbert"
+            "music": ["the album 'Music for Airports' by Brian Eno", "the album 'Selected Ambient Works 85-92' by Aphex Twin"],
+            "film": ["the documentary 'Abstract: The Art of Design'", "the movie 'Paterson'"],
+            "book": ["the book 'Big Magic' by Elizabeth Gilbert", "the book 'The Artist's Way' by Julia Cameron"]
         },
         "anxiety": {
-            "music": "the album 'Weightless' by Marconi Union",
-            "podcast": "the podcast 'Calm'",
-            "book": "the book 'Anxious Thoughts' by Katie Krimer"
+            "music": ["the album 'Weightless' by Marconi Union", "the album 'Sleep' by Max Richter"],
+            "podcast": ["the podcast 'Calm'", "the podcast 'Tara Brach'"],
+            "book": ["the book 'Anxious Thoughts' by Katie Krimer", "the book 'Wherever You Go, There You Are' by Jon Kabat-Zinn"]
         },
         "general": {
-            "music": "the album 'Vespertine' by Björk",
-            "film": "the movie 'My Neighbor Totoro'",
-            "book": "the book 'The Midnight Library' by Matt Haig"
+            "music": ["the album 'Vespertine' by Björk", "the album 'Music for 18 Musicians' by Steve Reich"],
+            "film": ["the movie 'My Neighbor Totoro'", "the movie 'Little Forest'"],
+            "book": ["the book 'The Midnight Library' by Matt Haig", "the book 'A Psalm for the Wild-Built' by Becky Chambers"]
         }
     }
     
-    return fallback_db.get(wellness_category, fallback_db["general"])
-
-async def create_personalized_ritual(
-    emotional_analysis: Dict,
-    recommendations: Dict,
-    user_preferences: Dict = None
-) -> str:
-    """Create a highly personalized ritual with advanced prompt engineering"""
-
-    return """
-    **Tonight's Ritual: A Sanctuary of Stillness**
-
-My dear friend, I sense you're carrying a weight, a gentle hum of stress.  Let's create a space for that to melt away. This ritual is designed to ease your mind and soothe your soul.
-
-Begin by settling into a comfortable position. Dim the lights if you like.  Let the immersive soundscapes of Jon Hopkins' *Immunity* wash over you. Allow the music's ebb and flow to mirror the rhythm of your breath, easing tension from your shoulders and jaw. (10 mins)
-
-As the music gently fades,  we'll shift to a different kind of listening. Put on an episode of 'Nothing Much Happens'.  This podcast's gentle pace and ordinary stories offer a grounding counterpoint to the rich sounds of the music, inviting you to simply be present, without striving. (10 mins)
-
-Finally, to deepen your sense of peace, open 'The Power of Now' by Eckhart Tolle. Read just a page or two—focus on a passage that resonates, allowing its wisdom to settle in your heart. This gentle practice connects your inner calm with insightful guidance. (10 mins)
-
-
-Close your eyes, and breathe deeply.  Repeat to yourself, “I am calm. I am peaceful. I am present.”  May this quietude linger with you long after our ritual ends.
-    """
+    candidates = fallback_db.get(wellness_category, fallback_db["general"])
+    scores = await ranking_store.scores(wellness_category)
+    return {domain: rank_candidates(options, scores)[0] for domain, options in candidates.items()}
 
+def ritual_prompts(emotional_analysis: Dict, recommendations: Dict) -> Tuple[str, str]:
+    """System and user prompts for writing a ritual from the analysis and recommendations"""
     primary_need = emotional_analysis.get("primary_need", "restoration")
     duration = emotional_analysis.get("recommended_duration", "30min")
     urgency = emotional_analysis.get("urgency", "medium")
@@ -376,9 +383,18 @@ Close your eyes, and breathe deeply.  Repeat to yourself, “I am calm. I am pea
     
     Keep it under 200 words, warm and personal.
     """
+    return system_prompt, user_prompt
+
+async def create_personalized_ritual(
+    emotional_analysis: Dict,
+    recommendations: Dict,
+    user_preferences: Dict = None
+) -> str:
+    """Create a highly personalized ritual with advanced prompt engineering"""
+    system_prompt, user_prompt = ritual_prompts(emotional_analysis, recommendations)
     
     try:
-        # response = await openai_client.chat.completions.create(
+        # response = await resources.openai.chat.completions.create(
         #     model=settings.OPENAI_MODEL,
         #     messages=[
         #         {"role": "system", "content": system_prompt},
@@ -388,13 +404,7 @@ Close your eyes, and breathe deeply.  Repeat to yourself, “I am calm. I am pea
         #     max_tokens=300
         # )
         # logger.info(response.choices[0].message.content.strip())
-        model = genai.GenerativeModel(
-            settings.GEMINI_MODEL,
-            system_instruction=system_prompt
-        )
-
-        response = model.generate_content(user_prompt)
-        result = response.text
+        result = await gemini_generate(system_prompt, user_prompt)
         # print(result)
         
         return result
@@ -413,4 +423,29 @@ Follow this with a few pages of reading something that nourishes your mind, or p
 
 Remember: this time is yours. You deserve this pause, this care, this moment of sanctuary.
 
-May you find the restoration you seek."""
\ No newline at end of file
+May you find the restoration you seek."""
+
+async def refine_ritual(
+    ritual_id: str,
+    emotional_analysis: Dict,
+    recommendations: Dict,
+    user_preferences: Dict = None
+):
+    """Replace a template-composed ritual with the LLM-written version.
+
+    Calls Gemini directly rather than `create_personalized_ritual`, whose generic
+    fallback text must never overwrite the tailored template ritual: on any
+    failure the stored ritual is left as it is.
+    """
+    try:
+        ritual_content = await gemini_generate(*ritual_prompts(emotional_analysis, recommendations))
+    except Exception as e:
+        logger.error(f"Ritual refinement error for {ritual_id}: {e}")
+        return
+    if not ritual_content or not ritual_content.strip():
+        logger.warning(f"Ritual refinement for {ritual_id} returned no text; keeping the template ritual")
+        return
+    try:
+        await update_ritual_content(ritual_id, ritual_content)
+    except Exception as e:
+        logger.error(f"Ritual refinement error for {ritual_id}: {e}")
@@ -0,0 +1,68 @@
+import json
+from typing import List, Dict, Any
+from utils.logger import logger
+
+class JSONObjectStream:
+    """Incremental parser that emits top-level JSON objects from streamed text.
+
+    Text outside of objects (Markdown fences, array brackets, commas, prose)
+    is skipped, so `[{...}, {...}]` wrapped in ```json fences yields each
+    object as soon as its closing brace arrives.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk of text and return the objects it completed"""
+        completed = []
+        for char in chunk:
+            if self._depth == 0:
+                if char == "{":
+                    self._buffer = [char]
+                    self._depth = 1
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode("".join(self._buffer))
+                    if obj is not None:
+                        completed.append(obj)
+                    self._buffer = []
+        return completed
+
+    def close(self) -> None:
+        """Signal end of input, logging any object left unterminated"""
+        if self._depth:
+            logger.warning(f"Discarding unterminated JSON object: {''.join(self._buffer)[:200]}")
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @staticmethod
+    def _decode(text: str):
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed JSON object in stream: {e}")
+            return None
+        return obj if isinstance(obj, dict) else None
@@ -1,7 +1,157 @@
+import atexit
+import contextvars
+import copy
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import orjson
+
+# Configured from the environment rather than Settings so logging works before
+# (and without) the app's required keys being present
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_BYTES = int(os.getenv("LOG_MAX_MESSAGE_BYTES", "4096"))
+# "logger.name=rate,..."; applies to records below WARNING from that logger or its children
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "sanctuary.payloads=0.1")
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_stats = {"enqueued": 0, "dropped": 0, "sampled_out": 0, "truncated": 0}
+
+def get_log_stats() -> Dict[str, int]:
+    """Counters for the logging pipeline, including records dropped on a full queue"""
+    return dict(_stats)
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the request ID of the originating request"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return orjson.dumps(payload).decode()
+
+class SamplingFilter(logging.Filter):
+    """Per-logger sampling of sub-WARNING records and a size cap on messages"""
+
+    def __init__(self, sample_rates: Dict[str, float], max_message_bytes: int):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.max_message_bytes = max_message_bytes
+
+    def sample_rate(self, name: str) -> float:
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and random.random() >= self.sample_rate(record.name):
+            _stats["sampled_out"] += 1
+            return False
+
+        message = record.getMessage()
+        if len(message) > self.max_message_bytes:
+            message = f"{message[:self.max_message_bytes]}... [truncated {len(message) - self.max_message_bytes} chars]"
+            _stats["truncated"] += 1
+        record.msg = message
+        record.args = None
+        record.request_id = request_id_var.get()
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a background writer thread and drops them when the queue is full.
+
+    The writer is started lazily per process, so workers forked from a
+    preloaded master each get their own queue and thread.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The filter already rendered the message; only exceptions need formatting here
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            _stats["enqueued"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self) -> None:
+        """Flush queued records; called at interpreter exit"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the app's pipeline; use a dedicated name for noisy payload logs"""
+    return logging.getLogger(name)
+
+def route_server_loggers(names=("uvicorn.access", "uvicorn.error")) -> None:
+    """Send the server's own loggers through the queue instead of their stream handlers.
+
+    Uvicorn (and gunicorn's UvicornWorker) attach blocking handlers to these
+    loggers once the server starts, so call this from the app's startup; the
+    records then get JSON formatting and request IDs, and `uvicorn.access`
+    can be sampled via LOG_SAMPLE_RATES.
+    """
+    for name in names:
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = [_queue_handler]
+        server_logger.propagate = False
+
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(JSONFormatter())
+_queue_handler = NonBlockingQueueHandler(_stream_handler, LOG_QUEUE_SIZE)
+_queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES), LOG_MAX_MESSAGE_BYTES))
+logging.basicConfig(level=LOG_LEVEL, handlers=[_queue_handler])
+atexit.register(_queue_handler.stop)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
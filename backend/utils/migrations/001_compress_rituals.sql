@@ -0,0 +1,59 @@
+-- Moves rituals from inline ritual_content/recommendations to content_zstd and
+-- interned recommendation_sets. Legacy columns stay nullable until
+-- `python -m utils.ritual_store backfill` has converted every row; then run 002.
+CREATE TABLE IF NOT EXISTS recommendation_sets (
+    hash CHAR(64) PRIMARY KEY,
+    recommendations JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS ritual_dictionaries (
+    id BIGINT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE rituals
+    ADD COLUMN IF NOT EXISTS content_zstd TEXT,
+    ADD COLUMN IF NOT EXISTS recommendations_hash CHAR(64) REFERENCES recommendation_sets(hash),
+    ADD COLUMN IF NOT EXISTS wellness_category VARCHAR(50) DEFAULT 'general',
+    ALTER COLUMN ritual_content DROP NOT NULL,
+    ALTER COLUMN recommendations DROP NOT NULL;
+
+DROP INDEX IF EXISTS idx_rituals_user_id;
+CREATE INDEX IF NOT EXISTS idx_rituals_user_created ON rituals(user_id, created_at, id);
+
+CREATE OR REPLACE FUNCTION create_ritual(p_ritual JSONB, p_recommendations JSONB)
+RETURNS rituals AS $$
+DECLARE
+    new_ritual rituals;
+BEGIN
+    INSERT INTO recommendation_sets (hash, recommendations)
+    VALUES (p_ritual->>'recommendations_hash', p_recommendations)
+    ON CONFLICT (hash) DO NOTHING;
+
+    INSERT INTO rituals (user_id, emotional_need, comfort_media, content_zstd, recommendations_hash, wellness_category, estimated_duration, created_at)
+    VALUES (
+        (p_ritual->>'user_id')::UUID,
+        p_ritual->>'emotional_need',
+        COALESCE(p_ritual->'comfort_media', '[]'),
+        p_ritual->>'content_zstd',
+        p_ritual->>'recommendations_hash',
+        COALESCE(p_ritual->>'wellness_category', 'general'),
+        COALESCE(p_ritual->>'estimated_duration', '30min'),
+        COALESCE((p_ritual->>'created_at')::TIMESTAMPTZ, NOW())
+    )
+    RETURNING * INTO new_ritual;
+
+    RETURN new_ritual;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION submit_ritual_feedback(p_ritual_id UUID, p_user_id UUID, p_rating INTEGER)
+RETURNS TABLE (previous_rating INTEGER, wellness_category VARCHAR, recommendations_hash CHAR(64)) AS $$
+    UPDATE rituals AS r
+    SET rating = p_rating
+    FROM rituals AS previous
+    WHERE r.id = previous.id AND r.id = p_ritual_id AND r.user_id = p_user_id
+    RETURNING previous.rating, r.wellness_category, r.recommendations_hash;
+$$ LANGUAGE sql;
@@ -0,0 +1,6 @@
+-- Run once `python -m utils.ritual_store backfill` reports no remaining rows.
+ALTER TABLE rituals
+    ALTER COLUMN content_zstd SET NOT NULL,
+    ALTER COLUMN recommendations_hash SET NOT NULL,
+    DROP COLUMN ritual_content,
+    DROP COLUMN recommendations;
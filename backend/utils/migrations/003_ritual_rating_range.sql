@@ -0,0 +1,6 @@
+-- Ratings feed the ranking aggregates, so only 1-5 stars are accepted.
+-- Out-of-range ratings written before this check are cleared rather than guessed.
+UPDATE rituals SET rating = NULL WHERE rating NOT BETWEEN 1 AND 5;
+
+ALTER TABLE rituals
+    ADD CONSTRAINT rituals_rating_range CHECK (rating BETWEEN 1 AND 5);
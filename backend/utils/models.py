@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
 from enum import Enum
@@ -23,6 +23,11 @@ class MediaType(str, Enum):
     TV_SHOW = "tv/show"
     PODCAST = "podcast"
 
+class RitualComposer(str, Enum):
+    LLM = "llm"
+    TEMPLATE = "template"
+    INSTANT = "instant"  # template now, LLM version stored in the background
+
 class UserSignupRequest(BaseModel):
     name: str
     email: EmailStr
@@ -75,10 +80,38 @@ class RitualRecord(BaseModel):
     comfort_media: List[str]
     ritual_content: str
     recommendations: Dict[str, Any]
+    wellness_category: str = "general"
     estimated_duration: str = "30min"
     rating: Optional[int] = None
     created_at: str
 
+class RitualSummary(BaseModel):
+    id: str
+    emotional_need: str
+    comfort_media: List[str]
+    recommendations_hash: Optional[str] = None  # None until a legacy row is backfilled
+    wellness_category: str = "general"
+    estimated_duration: str = "30min"
+    rating: Optional[int] = None
+    created_at: str
+
+class StoredRitual(RitualSummary):
+    """Ritual row as stored: zstd-compressed content and an interned recommendation set.
+
+    Rows written before compression carry `ritual_content`/`recommendations`
+    inline until `python -m utils.ritual_store backfill` converts them.
+    """
+    content_zstd: Optional[str] = None
+    ritual_content: Optional[str] = None
+    recommendations: Optional[Dict[str, Any]] = None
+
+class RitualDetail(RitualRecord):
+    id: str
+
+class RitualHistoryResponse(BaseModel):
+    rituals: List[RitualSummary]
+    recommendation_sets: Dict[str, Dict[str, Any]]
+
 class EmotionRequest(BaseModel):
     text: str
 
@@ -86,14 +119,17 @@ class RitualRequest(BaseModel):
     text: str
     comfort_media: List[str]
     preferences: Optional[Dict[str, Any]]
+    composer: Optional[RitualComposer] = None
 
 class RitualResponse(BaseModel):
     success: bool
     ritual: RitualRecord
+    ritual_id: Optional[str] = None
+    refining: bool = False
 
 class FeedbackRequest(BaseModel):
     ritual_id: str
-    rating: int
+    rating: int = Field(ge=1, le=5)
     comments: Optional[str] = None
 
 class AnalyticsResponse(BaseModel):
@@ -0,0 +1,114 @@
+import contextvars
+import hmac
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from utils.config import settings
+from utils.logger import get_logger
+from utils.serialization import dumps
+
+# Opt-in per-request profiling. Time spent in instrumented sections (hash, jwt,
+# db, serialize) is attributed per category. Requests sampled at
+# PROFILE_SAMPLE_RATE are only logged; a request whose `X-Profile` header
+# matches PROFILE_SECRET also gets the breakdown back in a Server-Timing header.
+# The breakdown reveals e.g. whether /signin ran bcrypt, so it is never sent
+# to anonymous clients.
+
+PROFILE_HEADER = "x-profile"
+
+_active: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar("profile", default=None)
+profile_logger = get_logger("sanctuary.profile")
+
+def header_authorized(header_value: Optional[str]) -> bool:
+    """True when the X-Profile header carries the configured PROFILE_SECRET"""
+    secret = settings.PROFILE_SECRET
+    if not secret or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode(), secret.encode())
+
+def sampled() -> bool:
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+def start_profile() -> contextvars.Token:
+    return _active.set({})
+
+def profile_report(total_seconds: float) -> Dict[str, Dict[str, float]]:
+    """`{category: {"ms": ..., "count": ...}}` for the current profile so far, including the total"""
+    spans = _active.get() or {}
+    report = {name: {"ms": round(seconds * 1000, 3), "count": count} for name, (seconds, count) in spans.items()}
+    report["total"] = {"ms": round(total_seconds * 1000, 3), "count": 1}
+    return report
+
+def finish_profile(token: contextvars.Token, total_seconds: float) -> Dict[str, Dict[str, float]]:
+    """Stop profiling and return the final report"""
+    report = profile_report(total_seconds)
+    _active.reset(token)
+    return report
+
+def server_timing(report: Dict[str, Dict[str, float]]) -> str:
+    return ", ".join(f"{name};dur={span['ms']}" for name, span in report.items())
+
+@contextmanager
+def profile_span(category: str):
+    """Attribute the enclosed time to `category` when the current request is profiled"""
+    spans = _active.get()
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds, count = spans.get(category, (0.0, 0))
+        spans[category] = (seconds + time.perf_counter() - started, count + 1)
+
+class ProfiledORJSONResponse(ORJSONResponse):
+    """ORJSONResponse whose rendering is attributed to the `serialize` category"""
+
+    def render(self, content) -> bytes:
+        with profile_span("serialize"):
+            return super().render(content)
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that profiles sampled or authorized requests.
+
+    The Server-Timing header is added when the response starts, after the
+    endpoint ran and the body was rendered; the logged report also covers
+    streaming the body.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        expose = header_authorized(Headers(scope=scope).get(PROFILE_HEADER))
+        if not expose and not sampled():
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        token = start_profile()
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if expose:
+                    headers = MutableHeaders(scope=message)
+                    headers["Server-Timing"] = server_timing(profile_report(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            report = finish_profile(token, time.perf_counter() - started)
+            profile_logger.info(f"{scope['method']} {scope['path']} {status_code} {dumps(report).decode()}")
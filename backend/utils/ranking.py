@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from utils.database import _iter_pages, resources
+from utils.logger import logger
+from utils.ritual_store import get_recommendation_sets
+
+# Ratings are 1-5; unrated items score as PRIOR_RATING, and PRIOR_WEIGHT
+# pseudo-ratings keep a single vote from swinging an item to the top or bottom
+PRIOR_RATING = 3.0
+PRIOR_WEIGHT = 5
+SNAPSHOT_TTL_SECONDS = 30
+
+def normalize_item(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def _keys(category: str) -> Tuple[str, str]:
+    return f"ranking:{category}:sum", f"ranking:{category}:count"
+
+class RankingStore:
+    """Per-item, per-wellness-category rating aggregates kept in Redis sorted sets.
+
+    Feedback updates a `sum` and a `count` sorted set with ZINCRBY (O(log n)).
+    Ranking reads a per-process snapshot of the category's scores, refreshed
+    at most every SNAPSHOT_TTL_SECONDS, so re-ranking candidates is in-memory.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, Tuple[float, Dict[str, float]]] = {}
+
+    async def record_rating(self, category: str, items: List[str], rating: int, previous_rating: Optional[int] = None) -> None:
+        """Add a rating for each item; a re-rating replaces the user's previous vote"""
+        sum_key, count_key = _keys(category)
+        delta = rating - (previous_rating or 0)
+        async with resources.redis.pipeline(transaction=False) as pipe:
+            for item in dict.fromkeys(map(normalize_item, items)):
+                pipe.zincrby(sum_key, delta, item)
+                if previous_rating is None:
+                    pipe.zincrby(count_key, 1, item)
+            await pipe.execute()
+        self._snapshots.pop(category, None)
+
+    async def replace_all(self, sums: Dict[str, Dict[str, float]], counts: Dict[str, Dict[str, float]]) -> None:
+        """Atomically replace every category's aggregates with the given totals"""
+        stale = [key async for key in resources.redis.scan_iter(match="ranking:*")]
+        async with resources.redis.pipeline(transaction=True) as pipe:
+            if stale:
+                pipe.delete(*stale)
+            for category, items in sums.items():
+                sum_key, count_key = _keys(category)
+                pipe.zadd(sum_key, items)
+                pipe.zadd(count_key, counts[category])
+            await pipe.execute()
+        self._snapshots.clear()
+
+    async def scores(self, category: str) -> Dict[str, float]:
+        """Smoothed mean rating per item in a category"""
+        cached = self._snapshots.get(category)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        sum_key, count_key = _keys(category)
+        try:
+            async with resources.redis.pipeline(transaction=False) as pipe:
+                pipe.zrange(sum_key, 0, -1, withscores=True)
+                pipe.zrange(count_key, 0, -1, withscores=True)
+                sums, counts = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Ranking snapshot unavailable for {category}: {e}")
+            return cached[1] if cached else {}
+
+        counts = {member: count for member, count in counts}
+        scores = {}
+        for member, total in sums:
+            count = counts.get(member, 0)
+            name = member.decode() if isinstance(member, bytes) else member
+            scores[name] = (total + PRIOR_RATING * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT)
+        self._snapshots[category] = (time.monotonic() + SNAPSHOT_TTL_SECONDS, scores)
+        return scores
+
+def rank_candidates(candidates: List[str], scores: Dict[str, float]) -> List[str]:
+    """Order candidates by rating, keeping the provider's order among equals"""
+    if not scores:
+        return candidates
+    return sorted(candidates, key=lambda text: -scores.get(normalize_item(text), PRIOR_RATING))
+
+ranking_store = RankingStore()
+
+async def record_ritual_rating(category: str, recommendations_hash: str, rating: int, previous_rating: Optional[int] = None) -> None:
+    """Feed a ritual's rating into the ranking of each recommendation it contained"""
+    try:
+        recommendation_sets = await get_recommendation_sets([recommendations_hash])
+        items = list(recommendation_sets.get(recommendations_hash, {}).values())
+        if items:
+            await ranking_store.record_rating(category or "general", items, rating, previous_rating)
+    except Exception as e:
+        logger.error(f"Ranking update error for {recommendations_hash}: {e}")
+
+async def rebuild_rankings(page_size: int = 500) -> int:
+    """Recompute all aggregates from the ratings stored on rituals; returns the ratings counted.
+
+    Feedback only applies deltas, so ratings given before the ranking store
+    existed (or lost while Redis was unavailable) must be counted here first:
+    run once after deploying rankings, after `ritual_store backfill`, and
+    again whenever the aggregates drift. Ratings submitted while it runs may
+    be missed, so prefer a quiet period.
+    """
+    sums: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    counts: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    counted = 0
+    columns = "id,created_at,wellness_category,recommendations_hash,rating"
+    async for page in _iter_pages("rituals", columns=columns, page_size=page_size):
+        rated = [row for row in page if row["rating"] is not None]
+        recommendation_sets = await get_recommendation_sets(row["recommendations_hash"] for row in rated)
+        for row in rated:
+            if row["recommendations_hash"] is None:
+                logger.warning(f"Skipping rating of ritual {row['id']}: run `python -m utils.ritual_store backfill` first")
+                continue
+            category = row["wellness_category"] or "general"
+            for item in dict.fromkeys(map(normalize_item, recommendation_sets.get(row["recommendations_hash"], {}).values())):
+                sums[category][item] += row["rating"]
+                counts[category][item] += 1
+            counted += 1
+    await ranking_store.replace_all(sums, counts)
+    logger.info(f"Rebuilt rankings from {counted} ratings in {len(sums)} categories")
+    return counted
+
+if __name__ == "__main__":
+    # python -m utils.ranking rebuild
+    asyncio.run(rebuild_rankings())
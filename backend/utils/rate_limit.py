@@ -0,0 +1,218 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from fastapi import Depends, HTTPException, Request, status
+from utils.config import settings
+from utils.database import resources
+from utils.logger import logger
+from utils.models import UserResponse
+from utils.security import get_current_user
+
+# Refills and draws from several buckets atomically. A request is only granted
+# if every bucket has a token; each bucket then hands out up to its requested
+# lease so the caller can serve later requests from memory.
+# ARGV per key: capacity, refill rate (tokens/ms), lease size.
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local tokens = {}
+local denied = 0
+local retry_ms = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now_ms
+    available = math.min(capacity, available + math.max(0, now_ms - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        if denied == 0 then denied = i end
+        retry_ms = math.max(retry_ms, math.ceil((1 - available) / rate))
+    end
+end
+local result = {denied, retry_ms}
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local lease = tonumber(ARGV[(i - 1) * 3 + 3])
+    local granted = 0
+    if denied == 0 then granted = math.min(lease, math.floor(tokens[i])) end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - granted), 'ts', now_ms)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate))
+    result[#result + 1] = granted
+end
+return result
+"""
+
+MAX_LOCAL_BUCKETS = 50_000
+
+class Bucket:
+    """Per-minute limit for one scope (user, ip or global) of a tier"""
+
+    def __init__(self, scope: str, per_minute: int):
+        self.scope = scope
+        self.capacity = per_minute
+        self.rate_per_ms = per_minute / 60_000
+        # Lease about a tenth of the bucket per Redis trip; tight per-user
+        # limits lease one token at a time to stay exact across workers
+        self.lease = max(1, per_minute // 10)
+
+def get_tiers() -> Dict[str, List[Bucket]]:
+    """Rate limit tiers; `expensive` endpoints fan out to Gemini and Qloo"""
+    return {
+        "expensive": [
+            Bucket("user", settings.RATE_LIMIT_EXPENSIVE_PER_MINUTE),
+            Bucket("ip", settings.RATE_LIMIT_EXPENSIVE_IP_PER_MINUTE),
+            Bucket("global", settings.RATE_LIMIT_EXPENSIVE_GLOBAL_PER_MINUTE),
+        ],
+        "cheap": [
+            Bucket("user", settings.RATE_LIMIT_CHEAP_PER_MINUTE),
+            Bucket("ip", settings.RATE_LIMIT_CHEAP_IP_PER_MINUTE),
+        ],
+    }
+
+class RateLimiter:
+    """Token buckets in Redis with an in-process fast path.
+
+    Each worker keeps a local balance of leased tokens and a `blocked_until`
+    deadline per key. Requests are admitted from the local balance, and when
+    it runs low a refill is fetched from Redis in the background, so the
+    request path does not wait on Redis. A key seen for the first time (or
+    whose refill hasn't landed yet) may overdraw by OVERDRAFT tokens; the
+    overshoot is bounded by OVERDRAFT per key per worker and is repaid out
+    of the next grant. Only a key past its overdraft waits for Redis. Redis
+    errors fail open. Local state is bounded by MAX_LOCAL_BUCKETS, evicting
+    the least recently used keys and expired blocks first.
+    """
+
+    OVERDRAFT = 1
+
+    def __init__(self):
+        self._tiers: Optional[Dict[str, List[Bucket]]] = None
+        self._script = None
+        self._script_client = None
+        self._leased: "OrderedDict[str, int]" = OrderedDict()
+        self._blocked_until: "OrderedDict[str, float]" = OrderedDict()
+        self._refilling: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+
+    @property
+    def tiers(self) -> Dict[str, List[Bucket]]:
+        if self._tiers is None:
+            self._tiers = get_tiers()
+        return self._tiers
+
+    def _get_script(self):
+        client = resources.redis
+        if self._script is None or self._script_client is not client:
+            self._script = client.register_script(TOKEN_BUCKET_LUA)
+            self._script_client = client
+        return self._script
+
+    def _keys(self, tier: str, user_id: Optional[str], ip: Optional[str]) -> List[Tuple[str, Bucket]]:
+        identities = {"user": user_id, "ip": ip, "global": "all"}
+        return [
+            (f"ratelimit:{tier}:{bucket.scope}:{identities[bucket.scope]}", bucket)
+            for bucket in self.tiers[tier]
+            if identities[bucket.scope]
+        ]
+
+    def _evict(self, now: float) -> None:
+        """Drop least recently used balances and, oldest first, blocks past MAX_LOCAL_BUCKETS"""
+        while len(self._leased) > MAX_LOCAL_BUCKETS:
+            self._leased.popitem(last=False)
+        if len(self._blocked_until) > MAX_LOCAL_BUCKETS:
+            for key in [key for key, until in self._blocked_until.items() if until <= now]:
+                del self._blocked_until[key]
+        while len(self._blocked_until) > MAX_LOCAL_BUCKETS:
+            self._blocked_until.popitem(last=False)
+
+    async def _refill(self, keys: List[Tuple[str, Bucket]]) -> Optional[float]:
+        """Lease tokens for `keys` from Redis; returns the retry delay if a bucket is empty"""
+        args = []
+        for _, bucket in keys:
+            args += [bucket.capacity, bucket.rate_per_ms, bucket.lease]
+        denied, retry_ms, *grants = await self._get_script()(keys=[key for key, _ in keys], args=args)
+        if denied:
+            retry_after = int(retry_ms) / 1000
+            blocked_key = keys[int(denied) - 1][0]
+            self._blocked_until[blocked_key] = time.monotonic() + retry_after
+            self._blocked_until.move_to_end(blocked_key)
+            return retry_after
+        for (key, _), granted in zip(keys, grants):
+            self._leased[key] = self._leased.get(key, 0) + int(granted)
+        return None
+
+    async def _background_refill(self, keys: List[Tuple[str, Bucket]]) -> None:
+        try:
+            await self._refill(keys)
+        except Exception as e:
+            logger.warning(f"Rate limiter refill failed: {e}")
+        finally:
+            self._refilling.difference_update(key for key, _ in keys)
+
+    async def check(self, tier: str, user_id: Optional[str] = None, ip: Optional[str] = None) -> None:
+        """Consume one token for the request or raise 429 with Retry-After"""
+        now = time.monotonic()
+        keys = self._keys(tier, user_id, ip)
+
+        for key, _ in keys:
+            blocked_until = self._blocked_until.get(key)
+            if blocked_until is not None:
+                if blocked_until > now:
+                    raise_rate_limited(blocked_until - now)
+                del self._blocked_until[key]
+
+        # Past the overdraft: this request has to wait for Redis
+        exhausted = [(key, bucket) for key, bucket in keys if self._leased.get(key, 0) - 1 < -self.OVERDRAFT]
+        if exhausted:
+            try:
+                retry_after = await self._refill(exhausted)
+            except Exception as e:
+                logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+                return
+            if retry_after is not None:
+                raise_rate_limited(retry_after)
+
+        for key, _ in keys:
+            self._leased[key] = self._leased.get(key, 0) - 1
+            self._leased.move_to_end(key)
+        self._evict(now)
+
+        # Top up keys running low without holding up the request
+        low = [
+            (key, bucket) for key, bucket in keys
+            if self._leased[key] < max(1, bucket.lease // 2) and key not in self._refilling
+        ]
+        if low:
+            self._refilling.update(key for key, _ in low)
+            task = asyncio.create_task(self._background_refill(low))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+def raise_rate_limited(retry_after: float):
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests, please slow down",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+limiter = RateLimiter()
+
+def client_ip(request: Request) -> Optional[str]:
+    """Caller's IP; the server resolves X-Forwarded-For from trusted proxies (FORWARDED_ALLOW_IPS)
+    into `request.client`, so untrusted peers cannot spoof it"""
+    return request.client.host if request.client else None
+
+def rate_limit(tier: str, authenticated: bool = True):
+    """Route dependency applying a tier's buckets to the caller's user ID and IP"""
+    if authenticated:
+        async def dependency(request: Request, user: UserResponse = Depends(get_current_user)):
+            await limiter.check(tier, user_id=str(user.id), ip=client_ip(request))
+    else:
+        async def dependency(request: Request):
+            await limiter.check(tier, ip=client_ip(request))
+    return Depends(dependency)
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import msgpack
+import orjson
+from utils.config import settings
+from utils.logger import logger
+
+# Record/replay of provider traffic (Gemini, Qloo).
+#
+#   PROVIDER_MODE=live    call providers directly (default)
+#   PROVIDER_MODE=record  call providers and append request/response/timing to PROVIDER_CASSETTE
+#   PROVIDER_MODE=replay  serve responses from PROVIDER_CASSETTE, sleeping for the recorded
+#                         latency scaled by REPLAY_LATENCY_SCALE (0 disables the delay)
+#
+# The cassette is a file of concatenated msgpack records. Repeated identical
+# requests are replayed in the order they were recorded, then cycle.
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was never recorded"""
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._records: Optional[Dict[str, List[dict]]] = None
+        self._positions: Dict[str, int] = defaultdict(int)
+        self._write_lock = threading.Lock()
+
+    def _load(self) -> Dict[str, List[dict]]:
+        if self._records is None:
+            self._records = defaultdict(list)
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    for record in msgpack.Unpacker(f, raw=False):
+                        self._records[record["key"]].append(record)
+        return self._records
+
+    def next(self, key: str) -> dict:
+        records = self._load().get(key)
+        if not records:
+            raise CassetteMiss(f"No recorded provider response for {key}")
+        position = self._positions[key]
+        self._positions[key] = position + 1
+        return records[position % len(records)]
+
+    def append(self, record: dict) -> None:
+        with self._write_lock:
+            with open(self.path, "ab") as f:
+                f.write(msgpack.packb(record, use_bin_type=True))
+        if self._records is not None:
+            self._records[record["key"]].append(record)
+
+_cassette: Optional[Cassette] = None
+
+def get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None or _cassette.path != settings.PROVIDER_CASSETTE:
+        _cassette = Cassette(settings.PROVIDER_CASSETTE)
+    return _cassette
+
+def request_key(provider: str, request: Any) -> str:
+    return f"{provider}:" + hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def _replay_delay(seconds: float) -> None:
+    delay = seconds * settings.REPLAY_LATENCY_SCALE
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+async def provider_call(provider: str, request: Any, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run a provider call through the configured record/replay mode.
+
+    `request` identifies the call (model, prompts, payload) and must be
+    JSON-serializable; the response returned by `call` must be msgpack-serializable.
+    """
+    mode = settings.PROVIDER_MODE
+    if mode == "replay":
+        record = get_cassette().next(request_key(provider, request))
+        await _replay_delay(record["elapsed"])
+        return record["response"]
+
+    started = time.perf_counter()
+    response = await call()
+    if mode == "record":
+        get_cassette().append({
+            "key": request_key(provider, request),
+            "provider": provider,
+            "request": request,
+            "response": response,
+            "elapsed": time.perf_counter() - started,
+        })
+    return response
+
+async def provider_stream(provider: str, request: Any, stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+    """Streaming counterpart of `provider_call`; records each chunk with its arrival offset"""
+    mode = settings.PROVIDER_MODE
+    if mode == "replay":
+        record = get_cassette().next(request_key(provider, request))
+        previous = 0.0
+        for offset, chunk in record["chunks"]:
+            await _replay_delay(offset - previous)
+            previous = offset
+            yield chunk
+        return
+
+    started = time.perf_counter()
+    chunks = []
+    async for chunk in stream():
+        chunks.append((time.perf_counter() - started, chunk))
+        yield chunk
+    if mode == "record":
+        get_cassette().append({
+            "key": request_key(provider, request),
+            "provider": provider,
+            "request": request,
+            "chunks": chunks,
+            "elapsed": time.perf_counter() - started,
+        })
+
+class NullRedis:
+    """Redis stand-in for benchmarks: every command fails, so caches and rankings
+    fail open and each iteration exercises the full provider path"""
+
+    def __getattr__(self, name: str):
+        raise ConnectionError("Redis is disabled in benchmark mode")
+
+    async def aclose(self) -> None:
+        pass
+
+async def benchmark(text: str, comfort_media: List[str], iterations: int = 10) -> Dict[str, float]:
+    """Run the ritual pipeline against the cassette and report mean stage timings in ms.
+
+    Redis is replaced with `NullRedis` so cached results don't hide provider latency.
+    """
+    from utils.database import resources
+    from utils.helpers import enhanced_emotion_analysis, pipelined_recommendations, create_personalized_ritual
+
+    resources.override(redis=NullRedis())
+
+    totals: Dict[str, float] = defaultdict(float)
+    for _ in range(iterations):
+        started = time.perf_counter()
+        analysis = await enhanced_emotion_analysis(text, "benchmark")
+        analysed = time.perf_counter()
+        _, recommendations = await pipelined_recommendations(comfort_media, analysis)
+        recommended = time.perf_counter()
+        await create_personalized_ritual(analysis, recommendations)
+        finished = time.perf_counter()
+        totals["emotion_analysis"] += analysed - started
+        totals["recommendations"] += recommended - analysed
+        totals["ritual"] += finished - recommended
+        totals["total"] += finished - started
+    return {stage: round(seconds * 1000 / iterations, 2) for stage, seconds in totals.items()}
+
+if __name__ == "__main__":
+    # python -m utils.replay "I feel burnt out" "Brian Eno, Spirited Away"
+    import sys
+    from utils.config import BenchmarkSettings
+    settings.override(BenchmarkSettings())
+    text, media = sys.argv[1], sys.argv[2]
+    print(asyncio.run(benchmark(text, [m.strip() for m in media.split(",")])))
@@ -0,0 +1,201 @@
+import asyncio
+import base64
+import hashlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+import orjson
+import zstandard as zstd
+from utils.database import _insert, _iter_pages, _rpc, _select, _update, _upsert
+from utils.logger import logger
+from utils.models import StoredRitual
+
+COMPRESSION_LEVEL = 6
+DICTIONARY_SIZE = 16 * 1024
+RECOMMENDATION_SET_CACHE_SIZE = 4096
+
+# Trained dictionaries by zstd dict id; frames record the id they were written with
+_dictionaries: Dict[int, zstd.ZstdCompressionDict] = {}
+_current_dictionary_id: Optional[int] = None
+_dictionaries_loaded = False
+_dictionary_lock = asyncio.Lock()
+
+# Recommendation sets are content-addressed and never change, so caching is always safe
+_recommendation_sets: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def recommendations_hash(recommendations: Dict[str, Any]) -> str:
+    """Content address of a recommendation set (SHA-256 of its canonical JSON)"""
+    return hashlib.sha256(orjson.dumps(recommendations, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def load_dictionaries(force: bool = False) -> None:
+    """Load trained dictionaries once per process; the newest is used for compression.
+
+    A failed load is retried on the next call instead of being remembered.
+    """
+    global _current_dictionary_id, _dictionaries_loaded
+    async with _dictionary_lock:
+        if _dictionaries_loaded and not force:
+            return
+        try:
+            result = await _select("ritual_dictionaries", order="created_at")
+        except Exception as e:
+            logger.warning(f"Could not load ritual dictionaries, compressing without one: {e}")
+            return
+        for row in result.data:
+            dictionary = zstd.ZstdCompressionDict(base64.b64decode(row["data"]))
+            _dictionaries[dictionary.dict_id()] = dictionary
+            _current_dictionary_id = dictionary.dict_id()
+        _dictionaries_loaded = True
+
+def compress_content(text: str) -> str:
+    """zstd-compress ritual text with the current dictionary, base64-encoded for PostgREST"""
+    dictionary = _dictionaries.get(_current_dictionary_id)
+    compressor = zstd.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+    return base64.b64encode(compressor.compress(text.encode())).decode()
+
+def decompress_content(blob: str) -> str:
+    """Inverse of `compress_content`, picking the dictionary recorded in the frame"""
+    data = base64.b64decode(blob)
+    dict_id = zstd.get_frame_parameters(data).dict_id
+    if dict_id and dict_id not in _dictionaries:
+        raise LookupError(f"Unknown ritual dictionary {dict_id}")
+    decompressor = zstd.ZstdDecompressor(dict_data=_dictionaries.get(dict_id) if dict_id else None)
+    return decompressor.decompress(data).decode()
+
+async def get_ritual_content(ritual: StoredRitual) -> str:
+    """Decompress a stored ritual's text, loading dictionaries if needed"""
+    if ritual.content_zstd is None:
+        return ritual.ritual_content or ""
+    await load_dictionaries()
+    try:
+        return decompress_content(ritual.content_zstd)
+    except LookupError:
+        # Another worker may have trained a newer dictionary
+        await load_dictionaries(force=True)
+        return decompress_content(ritual.content_zstd)
+
+def _cache_recommendation_set(set_hash: str, recommendations: Dict[str, Any]) -> None:
+    """Insert into the in-process LRU, evicting the oldest sets past RECOMMENDATION_SET_CACHE_SIZE"""
+    _recommendation_sets[set_hash] = recommendations
+    _recommendation_sets.move_to_end(set_hash)
+    while len(_recommendation_sets) > RECOMMENDATION_SET_CACHE_SIZE:
+        _recommendation_sets.popitem(last=False)
+
+async def get_recommendation_sets(hashes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Resolve recommendation set hashes, fetching only ones not cached in-process"""
+    found = {}
+    missing = []
+    for set_hash in dict.fromkeys(hashes):
+        if set_hash is None:
+            continue
+        if set_hash in _recommendation_sets:
+            _recommendation_sets.move_to_end(set_hash)
+            found[set_hash] = _recommendation_sets[set_hash]
+        else:
+            missing.append(set_hash)
+
+    if not missing:
+        return found
+
+    result = await _select("recommendation_sets", columns="hash,recommendations", filters=[("hash", missing)])
+    for row in result.data:
+        found[row["hash"]] = row["recommendations"]
+        _cache_recommendation_set(row["hash"], row["recommendations"])
+    return found
+
+async def store_ritual(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Intern the recommendation set and insert the compressed ritual in one RPC.
+
+    `record` is a dumped `RitualRecord`; returns the stored row.
+    """
+    await load_dictionaries()
+    row = dict(record)
+    recommendations = row.pop("recommendations")
+    set_hash = recommendations_hash(recommendations)
+    row["content_zstd"] = compress_content(row.pop("ritual_content"))
+    row["recommendations_hash"] = set_hash
+    result = await _rpc("create_ritual", {"p_ritual": row, "p_recommendations": recommendations})
+    _cache_recommendation_set(set_hash, recommendations)
+    return result.data
+
+async def expand_ritual(ritual: StoredRitual, recommendation_sets: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Ritual fields with decompressed content and resolved recommendations, for either storage format"""
+    record = ritual.model_dump(exclude={"content_zstd", "recommendations_hash", "ritual_content", "recommendations"})
+    record["ritual_content"] = await get_ritual_content(ritual)
+    if ritual.recommendations_hash is not None:
+        record["recommendations"] = recommendation_sets.get(ritual.recommendations_hash, {})
+    else:
+        record["recommendations"] = ritual.recommendations or {}
+    return record
+
+async def export_rituals(user_id: str, page_size: int = 200) -> AsyncIterator[bytes]:
+    """NDJSON lines of a user's full ritual history, oldest first, one page at a time"""
+    async for page in _iter_pages("rituals", filters=[("user_id", user_id)], page_size=page_size):
+        rituals = [StoredRitual(**row) for row in page]
+        recommendation_sets = await get_recommendation_sets(r.recommendations_hash for r in rituals)
+        lines = [orjson.dumps(await expand_ritual(ritual, recommendation_sets)) for ritual in rituals]
+        yield b"\n".join(lines) + b"\n"
+
+async def update_ritual_content(ritual_id: str, text: str) -> None:
+    """Replace a stored ritual's text"""
+    await load_dictionaries()
+    await _update("rituals", {"content_zstd": compress_content(text)}, filters=[("id", ritual_id)])
+
+async def train_dictionary(sample_size: int = 2000) -> Optional[int]:
+    """Train a dictionary from recent rituals and store it; returns its dict id"""
+    await load_dictionaries()
+    result = await _select("rituals", columns="content_zstd", order="created_at", desc=True, limit=sample_size)
+    samples = [decompress_content(row["content_zstd"]).encode() for row in result.data if row["content_zstd"]]
+    try:
+        dictionary = zstd.train_dictionary(DICTIONARY_SIZE, samples, level=COMPRESSION_LEVEL)
+    except zstd.ZstdError as e:
+        logger.error(f"Dictionary training failed with {len(samples)} samples: {e}")
+        return None
+
+    await _insert("ritual_dictionaries", {
+        "id": dictionary.dict_id(),
+        "data": base64.b64encode(dictionary.as_bytes()).decode(),
+    })
+    await load_dictionaries(force=True)
+    logger.info(f"Trained ritual dictionary {dictionary.dict_id()} from {len(samples)} samples")
+    return dictionary.dict_id()
+
+async def backfill_legacy_rituals(batch_size: int = 200) -> int:
+    """Compress inline ritual text and intern inline recommendations of pre-compression rows.
+
+    Run after migrations/001 and before migrations/002; returns the number of rows converted.
+    """
+    await load_dictionaries()
+    converted = 0
+    while True:
+        result = await _select(
+            "rituals",
+            columns="id,ritual_content,recommendations",
+            filters=[("content_zstd", None)],
+            limit=batch_size
+        )
+        if not result.data:
+            break
+
+        sets = {}
+        updates = []
+        for row in result.data:
+            recommendations = row.get("recommendations") or {}
+            set_hash = recommendations_hash(recommendations)
+            sets[set_hash] = recommendations
+            updates.append((row["id"], {
+                "content_zstd": compress_content(row.get("ritual_content") or ""),
+                "recommendations_hash": set_hash,
+            }))
+
+        await _upsert("recommendation_sets", [{"hash": h, "recommendations": r} for h, r in sets.items()])
+        for ritual_id, data in updates:
+            await _update("rituals", data, filters=[("id", ritual_id)])
+        converted += len(updates)
+        logger.info(f"Backfilled {converted} legacy rituals")
+    return converted
+
+if __name__ == "__main__":
+    # python -m utils.ritual_store [train|backfill]
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "train"
+    asyncio.run(backfill_legacy_rituals() if command == "backfill" else train_dictionary())
@@ -0,0 +1,113 @@
+import hashlib
+import re
+from typing import Dict, List
+
+# Local ritual composer: assembles a ritual from parameterized pieces indexed by
+# wellness category, urgency and duration, with no model call.
+
+TITLES = {
+    "burnout": ["A Sanctuary of Stillness", "Permission to Rest", "Setting the Weight Down"],
+    "anxiety": ["Finding Solid Ground", "A Slower Breath", "Quiet Harbor"],
+    "creative_block": ["Refilling the Well", "Room to Wander", "Sparks in the Dark"],
+    "overwhelmed": ["One Thing at a Time", "Making Space", "A Gentle Unwinding"],
+    "disconnected": ["Coming Back to Yourself", "A Thread of Warmth", "Gentle Return"],
+    "restless": ["Settling the Storm", "Still Water", "An Easy Landing"],
+    "general": ["A Moment of Peace", "Your Quiet Hour", "Soft Landing"],
+}
+
+ACKNOWLEDGMENTS = {
+    "high": [
+        "I can tell things feel heavy right now, and you need {need} more than anything. Let's keep this simple and kind.",
+        "You're carrying a lot at the moment. Right now, {need} comes first; nothing else needs your attention.",
+    ],
+    "medium": [
+        "It sounds like you've been running on reserves, and what you're craving is {need}. Let's make some room for it.",
+        "There's a quiet ask underneath everything today: {need}. This ritual is built around giving you exactly that.",
+    ],
+    "low": [
+        "You have a little space today to explore {need}. Let's use it gently and with curiosity.",
+        "Nothing urgent, just an invitation toward {need}. Take this at whatever pace feels good.",
+    ],
+}
+
+STRESS_OPENINGS = {
+    "high": "Before anything else, take three slow breaths, letting each exhale be longer than the inhale.",
+    "medium": "Dim the lights if you can, and settle into your most comfortable spot.",
+    "low": "Find a cozy corner and let your shoulders drop away from your ears.",
+}
+
+ACTIVITIES = {
+    "music": "Put on {rec} and let it fill the room. You don't need to do anything but listen and let the sound carry some of the tension out of your jaw and shoulders. ({minutes} mins)",
+    "podcast": "Press play on {rec}. Let an unhurried voice keep you company while your own thoughts get to rest for a while. ({minutes} mins)",
+    "book": "Open {rec} and read just a few pages. Stop at a line that stays with you and let it settle. ({minutes} mins)",
+    "film": "Settle in with {rec}. Let yourself be absorbed, phone face down and out of reach. ({minutes} mins)",
+    "tv": "Watch an episode of {rec}, somewhere warm with something comforting to sip. ({minutes} mins)",
+}
+
+TRANSITIONS = {
+    "high": ["When you're ready, and only then,", "Staying right where you are,"],
+    "medium": ["As that gently winds down,", "When it feels complete,"],
+    "low": ["Once you've lingered as long as you like,", "Whenever curiosity nudges you onward,"],
+}
+
+CLOSINGS = {
+    "burnout": "Close your eyes and tell yourself: \"I am allowed to rest. I have done enough today.\"",
+    "anxiety": "Place a hand on your chest and repeat: \"I am safe in this moment. I can take this one breath at a time.\"",
+    "creative_block": "Before you finish, jot down one small thing that sparked your interest. Ideas grow best when they're not forced.",
+    "overwhelmed": "Let one thing go for tonight. Everything else can wait until tomorrow.",
+    "disconnected": "Take a moment to notice one thing you're grateful for. You are more connected than you feel.",
+    "restless": "Let your body be heavy and still for a few breaths. There's nowhere else you need to be.",
+    "general": "Remember: this time is yours. You deserve this pause, this care, this moment of sanctuary.",
+}
+
+def _pick(options: List[str], seed: str, offset: int = 0) -> str:
+    """Deterministic choice so identical inputs always compose the same ritual"""
+    digest = hashlib.blake2b(seed.encode(), digest_size=4).digest()
+    return options[(int.from_bytes(digest, "big") + offset) % len(options)]
+
+def _duration_minutes(duration: str) -> int:
+    match = re.search(r"\d+", duration or "")
+    return int(match.group()) if match else 30
+
+def _urgency_level(urgency: str, stress_level) -> str:
+    urgency = urgency if urgency in ACKNOWLEDGMENTS else "medium"
+    try:
+        if int(stress_level) >= 8:
+            return "high"
+    except (TypeError, ValueError):
+        pass
+    return urgency
+
+def compose_ritual(emotional_analysis: Dict, recommendations: Dict[str, str]) -> str:
+    """Compose a ritual from templates and recommendation strings, without an LLM call"""
+    category = emotional_analysis.get("wellness_category", "general")
+    category = category if category in TITLES else "general"
+    need = str(emotional_analysis.get("primary_need") or "restoration").lower()
+    urgency = _urgency_level(emotional_analysis.get("urgency", "medium"), emotional_analysis.get("stress_level", 5))
+    minutes = _duration_minutes(emotional_analysis.get("recommended_duration", "30min"))
+    seed = f"{category}:{need}:{urgency}:{minutes}:" + ":".join(f"{k}={v}" for k, v in sorted(recommendations.items()))
+
+    # Primary picks first, one per domain; high urgency keeps the ritual to two steps
+    picks = []
+    for key, rec in recommendations.items():
+        domain = key.split("_")[0].split("/")[0]
+        if key.endswith("_alt") or domain not in ACTIVITIES or any(d == domain for d, _ in picks):
+            continue
+        picks.append((domain, rec))
+    picks = picks[:2 if urgency == "high" else 3]
+
+    paragraphs = [
+        f"**Tonight's Ritual: {_pick(TITLES[category], seed)}**",
+        _pick(ACKNOWLEDGMENTS[urgency], seed).format(need=need) + " " + STRESS_OPENINGS[urgency],
+    ]
+    per_activity = max(5, minutes // max(1, len(picks)))
+    for i, (domain, rec) in enumerate(picks):
+        activity = ACTIVITIES[domain].format(rec=rec, minutes=per_activity)
+        if i > 0:
+            transition = _pick(TRANSITIONS[urgency], seed, offset=i)
+            activity = f"{transition} {activity[0].lower()}{activity[1:]}"
+        paragraphs.append(activity)
+    if not picks:
+        paragraphs.append(f"Spend the next {minutes} minutes doing one small thing that feels nourishing: some quiet music, a few pages of a favorite book, or simply sitting by a window.")
+    paragraphs.append(CLOSINGS[category])
+    return "\n\n".join(paragraphs)
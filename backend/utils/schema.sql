@@ -23,4 +23,68 @@ CREATE TABLE tokens (
 
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_tokens_token ON tokens(token);
-CREATE INDEX idx_tokens_user_id ON tokens(user_id);
\ No newline at end of file
+CREATE INDEX idx_tokens_user_id ON tokens(user_id);
+CREATE TABLE recommendation_sets (
+    hash CHAR(64) PRIMARY KEY,
+    recommendations JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE ritual_dictionaries (
+    id BIGINT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE rituals (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    emotional_need VARCHAR(255) NOT NULL,
+    comfort_media JSONB NOT NULL DEFAULT '[]',
+    content_zstd TEXT NOT NULL,
+    recommendations_hash CHAR(64) NOT NULL REFERENCES recommendation_sets(hash),
+    wellness_category VARCHAR(50) DEFAULT 'general',
+    estimated_duration VARCHAR(50) DEFAULT '30min',
+    rating INTEGER CONSTRAINT rituals_rating_range CHECK (rating BETWEEN 1 AND 5),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Serves per-user history and keyset pagination on (created_at, id)
+CREATE INDEX idx_rituals_user_created ON rituals(user_id, created_at, id);
+
+CREATE OR REPLACE FUNCTION create_ritual(p_ritual JSONB, p_recommendations JSONB)
+RETURNS rituals AS $$
+DECLARE
+    new_ritual rituals;
+BEGIN
+    INSERT INTO recommendation_sets (hash, recommendations)
+    VALUES (p_ritual->>'recommendations_hash', p_recommendations)
+    ON CONFLICT (hash) DO NOTHING;
+
+    INSERT INTO rituals (user_id, emotional_need, comfort_media, content_zstd, recommendations_hash, wellness_category, estimated_duration, created_at)
+    VALUES (
+        (p_ritual->>'user_id')::UUID,
+        p_ritual->>'emotional_need',
+        COALESCE(p_ritual->'comfort_media', '[]'),
+        p_ritual->>'content_zstd',
+        p_ritual->>'recommendations_hash',
+        COALESCE(p_ritual->>'wellness_category', 'general'),
+        COALESCE(p_ritual->>'estimated_duration', '30min'),
+        COALESCE((p_ritual->>'created_at')::TIMESTAMPTZ, NOW())
+    )
+    RETURNING * INTO new_ritual;
+
+    RETURN new_ritual;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rates a ritual owned by the user, returning the previous rating so ranking
+-- aggregates can replace a re-rated vote instead of counting it twice
+CREATE OR REPLACE FUNCTION submit_ritual_feedback(p_ritual_id UUID, p_user_id UUID, p_rating INTEGER)
+RETURNS TABLE (previous_rating INTEGER, wellness_category VARCHAR, recommendations_hash CHAR(64)) AS $$
+    UPDATE rituals AS r
+    SET rating = p_rating
+    FROM rituals AS previous
+    WHERE r.id = previous.id AND r.id = p_ritual_id AND r.user_id = p_user_id
+    RETURNING previous.rating, r.wellness_category, r.recommendations_hash;
+$$ LANGUAGE sql;
@@ -0,0 +1,17 @@
+from typing import Any
+import msgpack
+import orjson
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact JSON bytes (handles datetimes, UUIDs, enums and dataclasses)"""
+    return orjson.dumps(obj)
+
+def loads(data: bytes | str) -> Any:
+    return orjson.loads(data)
+
+def pack(obj: Any) -> bytes:
+    """Binary encoding for values stored in Redis"""
+    return msgpack.packb(obj, use_bin_type=True)
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
@@ -0,0 +1,8 @@
+from uvicorn.workers import UvicornWorker
+
+class SanctuaryUvicornWorker(UvicornWorker):
+    """Uvicorn worker for gunicorn using uvloop and httptools.
+
+    Proxy headers are honoured for the peers in gunicorn's `forwarded_allow_ips`.
+    """
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on", "proxy_headers": True}